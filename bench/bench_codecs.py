@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Codec throughput benchmark
+Times decode and decode+write of one operation per supported codec
+"""
+
+import os
+import sys
+import time
+import hashlib
+import statistics
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_payload import Operation, OP_NAMES, apply_operation, iter_decompressed  # noqa: E402
+from synth import make_data, compressors  # noqa: E402
+
+
+def timings(repeat: int, func) -> list[float]:
+    """Time several runs of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def spread(times: list[float]) -> float:
+    """Relative gap between the median and fastest run, a measure of noise robust to one cold run"""
+    return (statistics.median(times) - min(times)) / min(times)
+
+
+def bench_codec(op_type: int, compressed: bytes, size: int, bs: int, fd: int, repeat: int) -> dict:
+    """Measure decode-only and decode+write throughput of one op"""
+    op = Operation(op_type=op_type, data_length=len(compressed),
+                   dst_extents=[(0, size // bs)], data_sha256=hashlib.sha256(compressed).digest())
+
+    def decode():
+        for _ in iter_decompressed(compressed, op_type, output_size=size):
+            pass
+
+    def extract():
+        apply_operation(fd, 0, op, compressed, bs)
+
+    decode_times = timings(repeat, decode)
+    return {
+        'codec': OP_NAMES[op_type],
+        'ratio': len(compressed) / size,
+        'decode_mbps': size / min(decode_times) / 1e6,
+        'decode_spread': spread(decode_times),
+        'extract_mbps': size / min(timings(repeat, extract)) / 1e6,
+    }
+
+
+def run(size: int, compressibility: float, repeat: int, seed: int = 1, bs: int = 4096) -> list[dict]:
+    """Benchmark every available codec on the same generated data"""
+    data = make_data(size, compressibility, seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fd = os.open(Path(tmp) / 'out.img', os.O_RDWR | os.O_CREAT)
+        try:
+            for op_type, compress in compressors().items():
+                results.append(bench_codec(op_type, compress(data), len(data), bs, fd, repeat))
+        finally:
+            os.close(fd)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark per-codec decode throughput')
+    ap.add_argument('-s', '--size', type=int, default=32, help='Op size in MB (default: 32)')
+    ap.add_argument('-c', '--compressibility', type=float, default=0.5,
+                    help='Fraction of redundant 4 KB blocks (default: 0.5)')
+    ap.add_argument('-r', '--repeat', type=int, default=3, help='Runs per measurement (default: 3)')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    results = run(args.size * 1024 * 1024, args.compressibility, args.repeat, args.seed)
+
+    print(f"Op size: {args.size} MB, compressibility: {args.compressibility}\n")
+    print(f"{'Codec':<12} {'Ratio':>7} {'Decode':>12} {'Extract':>12}")
+    print("-" * 46)
+    for r in results:
+        print(f"{r['codec']:<12} {r['ratio']:>7.3f} {r['decode_mbps']:>8.0f} MB/s {r['extract_mbps']:>8.0f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
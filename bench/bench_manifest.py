@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Manifest parse benchmark
+Times load_payload and full operation decoding on a synthetic manifest
+"""
+
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_payload import Operation, OP_REPLACE_XZ, load_payload, format_size  # noqa: E402
+from synth import encode_partition, encode_manifest, encode_header  # noqa: E402
+
+
+def make_manifest(partitions: int, ops: int, seed: int) -> bytes:
+    """Build a manifest shaped like a full OTA: many partitions, many ops each"""
+    rnd = random.Random(seed)
+    records = []
+    offset = 0
+    for p in range(partitions):
+        block = 0
+        operations = []
+        for i in range(ops):
+            num = rnd.randint(1, 512)
+            length = rnd.randint(4096, 2 * 1024 * 1024)
+            operations.append(Operation(
+                op_type=OP_REPLACE_XZ, data_offset=offset, data_length=length,
+                dst_extents=[(block, num)],
+                data_sha256=hashlib.sha256(f"{p}:{i}".encode()).digest()))
+            block += num
+            offset += length
+        records.append(encode_partition(f"part{p}", block * 4096, operations))
+    return encode_manifest(4096, records)
+
+
+def best_of(repeat: int, func) -> float:
+    """Return the fastest of several timed runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark manifest parsing')
+    ap.add_argument('--partitions', type=int, default=60, help='Partition count (default: 60)')
+    ap.add_argument('--ops', type=int, default=1000, help='Operations per partition (default: 1000)')
+    ap.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement (default: 5)')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    manifest = make_manifest(args.partitions, args.ops, args.seed)
+    total_ops = args.partitions * args.ops
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'payload.bin'
+        path.write_bytes(encode_header(manifest))
+
+        def scan():
+            load_payload(path)
+
+        def decode():
+            for part in load_payload(path).partitions:
+                part.operations
+
+        def decode_compact():
+            for part in load_payload(path, compact=True).partitions:
+                part.operations
+
+        print(f"Manifest: {format_size(len(manifest))}, {args.partitions} partitions, {total_ops} ops\n")
+        print(f"{'Stage':<22} {'Time':>10} {'Ops/s':>12}")
+        print("-" * 46)
+        stages = (
+            ('load_payload (scan)', scan),
+            ('full op decode', decode),
+            ('compact op decode', decode_compact),
+        )
+        for name, func in stages:
+            elapsed = best_of(args.repeat, func)
+            print(f"{name:<22} {elapsed * 1000:>8.1f}ms {total_ops / elapsed:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
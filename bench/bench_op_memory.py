@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Operation table memory benchmark
+Compares heap usage of list[Operation] against the array-backed OperationTable
+"""
+
+import sys
+import random
+import hashlib
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_payload import (  # noqa: E402
+    Operation, OperationTable, OP_REPLACE_XZ, format_size, parse_operation,
+)
+from synth import encode_operation  # noqa: E402
+
+
+def make_operations(count: int, max_extents: int, seed: int) -> list[Operation]:
+    """Generate synthetic REPLACE_XZ operations resembling a large partition"""
+    rnd = random.Random(seed)
+    ops = []
+    block = offset = 0
+    for i in range(count):
+        extents = []
+        for _ in range(rnd.randint(1, max_extents)):
+            num = rnd.randint(1, 512)
+            extents.append((block, num))
+            block += num
+        length = rnd.randint(4096, 2 * 1024 * 1024)
+        ops.append(Operation(
+            op_type=OP_REPLACE_XZ,
+            data_offset=offset,
+            data_length=length,
+            dst_extents=extents,
+            data_sha256=hashlib.sha256(i.to_bytes(8, 'little')).digest(),
+        ))
+        offset += length
+    return ops
+
+
+def measure(build) -> tuple[int, int]:
+    """Return (retained, peak) bytes allocated while building a structure"""
+    tracemalloc.start()
+    result = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Compare operation storage memory usage')
+    ap.add_argument('-n', '--ops', type=int, default=50000, help='Number of operations (default: 50000)')
+    ap.add_argument('-e', '--max-extents', type=int, default=4, help='Max extents per op (default: 4)')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    # Both layouts are decoded from the same serialized manifest records
+    records = [encode_operation(op) for op in make_operations(args.ops, args.max_extents, args.seed)]
+
+    def build_list():
+        return [parse_operation(record) for record in records]
+
+    def build_table():
+        return OperationTable(parse_operation(record) for record in records)
+
+    print(f"Operations: {args.ops}, max extents/op: {args.max_extents}\n")
+    print(f"{'Layout':<16} {'Retained':>12} {'Peak':>12} {'Per op':>10}")
+    print("-" * 53)
+    for name, build in (('list[Operation]', build_list), ('OperationTable', build_table)):
+        retained, peak = measure(build)
+        print(f"{name:<16} {format_size(retained):>12} {format_size(peak):>12} {retained / args.ops:>8.1f} B")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Extraction benchmark suite
+Generates a synthetic CrAU v2 payload and times manifest parsing, per-codec
+decode and end-to-end extraction; results can be saved as JSON and compared
+between commits with compare.py
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from contextlib import redirect_stdout
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_payload import ExtractOptions, load_payload, extract_partitions, file_sha256, format_size  # noqa: E402
+from synth import DEFAULT_MIX, make_payload  # noqa: E402
+from bench_codecs import timings, spread  # noqa: E402
+import bench_codecs  # noqa: E402
+
+
+def git_commit() -> str | None:
+    """Commit of the checkout being measured, if it is a git repository"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_parse(path: Path, repeat: int) -> list[dict]:
+    """Time manifest scanning and full op decoding"""
+    def scan():
+        load_payload(path)
+
+    def decode():
+        for part in load_payload(path).partitions:
+            part.operations
+
+    results = []
+    for name, func in (('parse.scan', scan), ('parse.decode_ops', decode)):
+        # Sub-millisecond calls are timed in loops of at least 0.2s, like timeit does
+        timer = timeit.Timer(func)
+        number = timer.autorange()[0]
+        times = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+        results.append({'name': name, 'unit': 'ms', 'value': min(times) * 1000, 'spread': spread(times)})
+    return results
+
+
+def bench_extract(path: Path, digests: dict, jobs: int, repeat: int, out_dir: Path) -> dict:
+    """Time extracting every partition with the given thread count, then check the images"""
+    payload = load_payload(path)
+    outputs = [out_dir / f"{part.name}.img" for part in payload.partitions]
+    total = sum(part.size for part in payload.partitions)
+    options = ExtractOptions(jobs=jobs, progress='none')
+
+    def extract():
+        with redirect_stdout(io.StringIO()):
+            if not extract_partitions(payload, payload.partitions, outputs, options):
+                raise RuntimeError("Extraction failed")
+
+    times = timings(repeat, extract)
+    for part, out in zip(payload.partitions, outputs):
+        if digests and file_sha256(out) != digests[part.name]:
+            raise RuntimeError(f"{part.name}: extracted image does not match")
+    return {'name': f"extract.j{jobs}", 'unit': 'MB/s', 'value': total / min(times) / 1e6, 'spread': spread(times)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark parse, decode and extraction on a synthetic payload')
+    ap.add_argument('--partitions', type=int, default=4, help='Partition count (default: 4)')
+    ap.add_argument('--ops', type=int, default=16, help='Operations per partition (default: 16)')
+    ap.add_argument('--op-size', type=int, default=1024, metavar='KB',
+                    help='Uncompressed size of each op in KB (default: 1024)')
+    ap.add_argument('--mix', default=DEFAULT_MIX,
+                    help=f'Weighted codec mix of replace/bz/xz/zero/zstd/lz4 (default: {DEFAULT_MIX})')
+    ap.add_argument('-c', '--compressibility', type=float, default=0.5,
+                    help='Fraction of redundant 4 KB blocks (default: 0.5)')
+    ap.add_argument('-j', '--jobs', type=int, nargs='+', default=[1, os.cpu_count() or 1], metavar='N',
+                    help='Thread counts to extract with (default: 1 and the CPU count)')
+    ap.add_argument('-r', '--repeat', type=int, default=5,
+                    help='Runs per measurement; the best is kept and the spread recorded as noise (default: 5)')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--payload', type=Path, help='Benchmark this payload instead of generating one')
+    ap.add_argument('--keep', type=Path, metavar='PATH', help='Save the generated payload to PATH')
+    ap.add_argument('--json', type=Path, metavar='FILE', help='Write results as JSON to FILE')
+    args = ap.parse_args()
+    args.jobs = list(dict.fromkeys(args.jobs))
+
+    params = {k: v for k, v in vars(args).items() if k not in ('payload', 'keep', 'json')}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        digests = {}
+        if args.payload:
+            path = args.payload
+            params['payload'] = str(path)
+        else:
+            path = args.keep or tmp / 'payload.bin'
+            start = time.perf_counter()
+            digests = make_payload(path, args.partitions, args.ops, args.op_size * 1024, args.mix,
+                                   args.compressibility, args.seed)
+            print(f"Generated {format_size(path.stat().st_size)} payload in {time.perf_counter() - start:.1f}s\n")
+
+        results += bench_parse(path, args.repeat)
+        for r in bench_codecs.run(args.op_size * 1024, args.compressibility, args.repeat, args.seed):
+            if r['codec'] == 'REPLACE':
+                continue  # "decoding" REPLACE only slices a memoryview; nothing to measure
+            results.append({'name': f"decode.{r['codec']}", 'unit': 'MB/s', 'value': r['decode_mbps'],
+                            'spread': r['decode_spread']})
+        for jobs in args.jobs:
+            results.append(bench_extract(path, digests, jobs, args.repeat, tmp))
+
+    print(f"{'Benchmark':<24} {'Result':>14} {'Spread':>8}")
+    print("-" * 48)
+    for r in results:
+        print(f"{r['name']:<24} {r['value']:>9.2f} {r['unit']:<4} {r['spread']:>7.1%}")
+
+    if args.json:
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            },
+            'params': params,
+            'results': results,
+        }
+        args.json.write_text(json.dumps(report, indent=2) + '\n')
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark result comparison
+Prints the change of every metric between two bench_suite.py JSON files
+A change only counts as a regression when it exceeds both the threshold and
+the run-to-run spread either file recorded for that metric
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+LOWER_IS_BETTER = ('ms', 's')
+
+
+def load(path: Path) -> tuple[dict, dict]:
+    """Return (meta, {name: result}) from a results file"""
+    report = json.loads(path.read_text())
+    return report['meta'], {r['name']: r for r in report['results']}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Compare two bench_suite.py result files')
+    ap.add_argument('old', type=Path, help='Baseline results JSON')
+    ap.add_argument('new', type=Path, help='Results JSON to compare against the baseline')
+    ap.add_argument('--threshold', type=float, default=10.0,
+                    help='Minimum percent change flagged as a regression, raised to the measured '
+                         'spread of noisy metrics (default: 10)')
+    args = ap.parse_args()
+
+    old_meta, old = load(args.old)
+    new_meta, new = load(args.new)
+    print(f"Old: {old_meta.get('commit') or args.old}  New: {new_meta.get('commit') or args.new}\n")
+
+    print(f"{'Benchmark':<24} {'Old':>10} {'New':>10} {'Change':>9} {'Noise':>7}")
+    print("-" * 64)
+    regressions = 0
+    for name in list(old) + [name for name in new if name not in old]:
+        if name not in old or name not in new:
+            print(f"{name:<24} {'only in ' + ('new' if name in new else 'old'):>30}")
+            continue
+        a, b = old[name]['value'], new[name]['value']
+        change = (b - a) / a * 100 if a else 0.0
+        worse = -change if old[name]['unit'] not in LOWER_IS_BETTER else change
+        # Results files from before spreads were recorded count as noiseless
+        noise = max(old[name].get('spread', 0.0), new[name].get('spread', 0.0)) * 100
+        flag = ''
+        if worse > max(args.threshold, noise):
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{name:<24} {a:>10.2f} {b:>10.2f} {change:>+8.1f}% {noise:>6.1f}%{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
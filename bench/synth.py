@@ -0,0 +1,248 @@
+"""
+Synthetic payload building blocks for benchmarks
+Minimal protobuf encoder for the update_metadata messages extract_payload reads
+"""
+
+import sys
+import bz2
+import lzma
+import random
+import struct
+import hashlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_payload import (  # noqa: E402
+    Operation, OP_REPLACE, OP_REPLACE_BZ, OP_REPLACE_XZ, OP_ZERO, OP_ZSTD, OP_LZ4,
+)
+
+CODEC_NAMES = {
+    'replace': OP_REPLACE, 'bz': OP_REPLACE_BZ, 'xz': OP_REPLACE_XZ,
+    'zero': OP_ZERO, 'zstd': OP_ZSTD, 'lz4': OP_LZ4,
+}
+DEFAULT_MIX = 'xz=4,bz=1,replace=1,zero=1'
+
+
+def make_data(size: int, compressibility: float, seed: int = 0) -> bytes:
+    """Generate size bytes where roughly a compressibility fraction of 4 KB blocks is redundant"""
+    rnd = random.Random(seed)
+    pattern = rnd.randbytes(256) * 16
+    blocks = []
+    for _ in range(size // 4096):
+        roll = rnd.random()
+        if roll < compressibility / 2:
+            blocks.append(bytes(4096))
+        elif roll < compressibility:
+            blocks.append(pattern)
+        else:
+            blocks.append(rnd.randbytes(4096))
+    return b''.join(blocks)
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode an unsigned varint"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_field(field_num: int, value) -> bytes:
+    """Encode a varint (int) or length-delimited (bytes) field"""
+    if isinstance(value, int):
+        return encode_varint(field_num << 3) + encode_varint(value)
+    return encode_varint(field_num << 3 | 2) + encode_varint(len(value)) + value
+
+
+def encode_extent(start: int, num: int) -> bytes:
+    """Encode an Extent message"""
+    return encode_field(1, start) + encode_field(2, num)
+
+
+def encode_operation(op: Operation) -> bytes:
+    """Encode an InstallOperation message"""
+    out = encode_field(1, op.op_type)
+    if op.data_length:
+        out += encode_field(2, op.data_offset) + encode_field(3, op.data_length)
+    for start, num in op.src_extents:
+        out += encode_field(4, encode_extent(start, num))
+    for start, num in op.dst_extents:
+        out += encode_field(6, encode_extent(start, num))
+    if op.data_sha256:
+        out += encode_field(8, op.data_sha256)
+    if op.src_sha256:
+        out += encode_field(9, op.src_sha256)
+    return out
+
+
+def encode_partition(name: str, size: int, operations: list[Operation], digest: bytes = b'') -> bytes:
+    """Encode a PartitionUpdate message"""
+    info = encode_field(1, size)
+    if digest:
+        info += encode_field(2, digest)
+    out = encode_field(1, name.encode()) + encode_field(7, info)
+    return out + b''.join(encode_field(8, encode_operation(op)) for op in operations)
+
+
+def encode_manifest(block_size: int, partitions: list[bytes]) -> bytes:
+    """Encode a DeltaArchiveManifest from encoded PartitionUpdate messages"""
+    return encode_field(3, block_size) + b''.join(encode_field(13, part) for part in partitions)
+
+
+def encode_header(manifest: bytes, signature_size: int = 0) -> bytes:
+    """Encode the CrAU v2 payload header followed by the manifest"""
+    return (b'CrAU' + struct.pack('>QQI', 2, len(manifest), signature_size)) + manifest
+
+
+def _lz4_length(out: bytearray, length: int):
+    """Append the LZ4 length continuation bytes for a length >= 15"""
+    length -= 15
+    while length >= 255:
+        out.append(255)
+        length -= 255
+    out.append(length)
+
+
+def lz4_block_compress(data: bytes) -> bytes:
+    """Greedy LZ4 block compressor, so LZ4 ops can be generated without the lz4 package"""
+    data = bytes(data)
+    n = len(data)
+    out = bytearray()
+    table = {}
+    anchor = pos = 0
+    match_limit = n - 12  # the last match must start 12 bytes before the end
+    while pos < match_limit:
+        key = data[pos:pos + 4]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None or pos - candidate > 0xFFFF:
+            pos += 1
+            continue
+
+        length = 4
+        max_length = n - 5 - pos  # the last 5 bytes are always literals
+        while length + 64 <= max_length and \
+                data[candidate + length:candidate + length + 64] == data[pos + length:pos + length + 64]:
+            length += 64
+        while length < max_length and data[candidate + length] == data[pos + length]:
+            length += 1
+
+        literals = pos - anchor
+        out.append(min(literals, 15) << 4 | min(length - 4, 15))
+        if literals >= 15:
+            _lz4_length(out, literals)
+        out += data[anchor:pos]
+        out += (pos - candidate).to_bytes(2, 'little')
+        if length - 4 >= 15:
+            _lz4_length(out, length - 4)
+        pos += length
+        anchor = pos
+
+    literals = n - anchor
+    out.append(min(literals, 15) << 4)
+    if literals >= 15:
+        _lz4_length(out, literals)
+    out += data[anchor:]
+    return bytes(out)
+
+
+def zstd_compressor():
+    """Return a ZSTD compress function, or None when no backend is installed"""
+    try:
+        from compression import zstd
+        return zstd.compress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdCompressor().compress
+    except ImportError:
+        return None
+
+
+def lz4_compressor():
+    """Return an LZ4 block compress function, preferring the lz4 package"""
+    try:
+        import lz4.block
+        return lambda data: lz4.block.compress(data, store_size=False)
+    except ImportError:
+        return lz4_block_compress
+
+
+def compressors() -> dict:
+    """Op type -> compress function for every codec available here"""
+    codecs = {
+        OP_REPLACE: lambda data: data,
+        OP_REPLACE_BZ: bz2.compress,
+        OP_REPLACE_XZ: lzma.compress,
+        OP_LZ4: lz4_compressor(),
+    }
+    if zstd := zstd_compressor():
+        codecs[OP_ZSTD] = zstd
+    return codecs
+
+
+def parse_mix(spec: str) -> dict[int, float]:
+    """Parse a codec mix such as 'xz=4,bz=1,zero=1' into op type -> weight"""
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in CODEC_NAMES:
+            raise ValueError(f"Unknown codec '{name}'. Choose from: {', '.join(CODEC_NAMES)}")
+        mix[CODEC_NAMES[name.strip()]] = float(weight or 1)
+    return mix
+
+
+def make_payload(path: Path, partitions: int = 4, ops: int = 16, op_size: int = 1024 * 1024,
+                 mix: str = DEFAULT_MIX, compressibility: float = 0.5, seed: int = 1,
+                 block_size: int = 4096) -> dict[str, bytes]:
+    """Write a valid full CrAU v2 payload and return the SHA-256 of each partition image.
+
+    Every partition has `ops` operations of op_size bytes, each using a codec
+    drawn from the weighted mix, and its extents are shuffled across the
+    image like a real full OTA.
+    """
+    rnd = random.Random(seed)
+    codecs = compressors()
+    mix = parse_mix(mix)
+    missing = [op_type for op_type in mix if op_type != OP_ZERO and op_type not in codecs]
+    if missing:
+        raise ValueError(f"No compressor available for op type(s) {missing}")
+    op_types, weights = list(mix), list(mix.values())
+    blocks_per_op = max(1, op_size // block_size)
+
+    blobs = []
+    records = []
+    digests = {}
+    offset = 0
+    for p in range(partitions):
+        name = f"part{p}"
+        slots = list(range(ops))
+        rnd.shuffle(slots)  # op i writes to a random place in the image
+        image = bytearray(ops * blocks_per_op * block_size)
+        operations = []
+        for i, slot in enumerate(slots):
+            op_type = rnd.choices(op_types, weights)[0]
+            start = slot * blocks_per_op
+            op = Operation(op_type=op_type, dst_extents=[(start, blocks_per_op)])
+            if op_type != OP_ZERO:
+                data = make_data(blocks_per_op * block_size, compressibility, rnd.getrandbits(32))
+                image[start * block_size:(start + blocks_per_op) * block_size] = data
+                blob = codecs[op_type](data)
+                op.data_offset = offset
+                op.data_length = len(blob)
+                op.data_sha256 = hashlib.sha256(blob).digest()
+                blobs.append(blob)
+                offset += len(blob)
+            operations.append(op)
+        digests[name] = hashlib.sha256(image).digest()
+        records.append(encode_partition(name, len(image), operations, digests[name]))
+
+    with open(path, 'wb') as f:
+        f.write(encode_header(encode_manifest(block_size, records)))
+        for blob in blobs:
+            f.write(blob)
+    return digests
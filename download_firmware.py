@@ -4,12 +4,15 @@ OnePlus Open Firmware Downloader
 Downloads the latest full firmware (not OTA) for OnePlus Open CPH2551
 """
 
+import os
 import sys
 import hashlib
 import argparse
 import json
 import time
+import random
 import threading
+from collections import deque
 from pathlib import Path
 from typing import Optional
 from urllib.request import Request, urlopen
@@ -24,6 +27,14 @@ USER_AGENT = "Oxygen_updater_6.7.6"
 TIMEOUT = 30  # Connection timeout in seconds
 DOWNLOAD_TIMEOUT = 300  # Download timeout per chunk (5 minutes)
 CHUNK_SIZE = 5 * 1024 * 1024  # 5 MB chunks for downloads and MD5 calculation
+SEGMENT_SIZE = 16 * 1024 * 1024  # Byte range handed to a connection at a time
+SEGMENT_READ_SIZE = 1024 * 1024  # Read size within a segment (granularity of tail splitting)
+MIN_SPLIT_SIZE = 4 * 1024 * 1024  # Smallest half worth stealing from a slow connection
+RETRIES = 5  # Default retries per segment before giving up
+RETRY_DELAY = 1.0  # First retry backoff in seconds, doubled on each further attempt
+RETRY_DELAY_MAX = 30.0  # Backoff ceiling in seconds
+JOURNAL_SUFFIX = '.part.json'  # Sidecar recording finished ranges of a partial download
+JOURNAL_INTERVAL = 5.0  # Seconds between journal saves of in-flight segment progress
 
 # Regional variant mapping
 VARIANT_TO_REGION = {
@@ -228,8 +239,8 @@ def calculate_md5(file_path: Path) -> str:
     return md5.hexdigest()
 
 
-def check_range_support(url: str) -> tuple[bool, int]:
-    """Check if server supports byte range requests and get file size"""
+def check_range_support(url: str) -> tuple[bool, int, Optional[str]]:
+    """Check if server supports byte range requests and get file size and ETag"""
     try:
         req = Request(url, method='HEAD')
         req.add_header('User-Agent', USER_AGENT)
@@ -241,132 +252,368 @@ def check_range_support(url: str) -> tuple[bool, int]:
             supports_range = accept_ranges.lower() == 'bytes'
             file_size = int(content_length) if content_length.isdigit() else 0
 
-            return supports_range, file_size
+            return supports_range, file_size, response.headers.get('ETag')
     except (URLError, HTTPError):
-        return False, 0
+        return False, 0, None
 
 
-def download_chunk(url: str, start: int, end: int, output_path: Path,
-                   chunk_id: int, progress_tracker: dict, lock: threading.Lock) -> bool:
-    """Download a specific byte range and write directly to disk"""
+def journal_path(output_path: Path) -> Path:
+    """Path of the resume journal kept next to a partial download"""
+    return output_path.with_name(output_path.name + JOURNAL_SUFFIX)
+
+
+def load_journal(output_path: Path, url: str, total_size: int, etag: Optional[str]) -> list[tuple[int, int]]:
+    """Return the finished [start, end) ranges of a partial download, or [] if it can't be resumed
+
+    The journal is only trusted if it was written for the same URL, size and
+    ETag and the preallocated output file is still there.
+    """
+    try:
+        journal = json.loads(journal_path(output_path).read_text())
+        if (journal.get('url'), journal.get('size'), journal.get('etag')) != (url, total_size, etag):
+            print_warning("Partial download is for a different file, starting over")
+            return []
+        if output_path.stat().st_size != total_size:
+            return []
+        return [(start, end) for start, end in journal['done'] if 0 <= start < end <= total_size]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+def save_journal(output_path: Path, url: str, total_size: int, etag: Optional[str],
+                 done: list[tuple[int, int]]):
+    """Atomically record the finished ranges of a partial download
+
+    The output file is synced first so the journal never claims data that
+    could still be lost in a crash.
+    """
+    path = journal_path(output_path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(output_path, 'rb') as f:
+            os.fsync(f.fileno())
+        with open(tmp_path, 'w') as f:
+            json.dump({'url': url, 'size': total_size, 'etag': etag, 'done': done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print_warning(f"Failed to update download journal: {e}")
+
+
+def merge_ranges(ranges) -> list[tuple[int, int]]:
+    """Sort [start, end) ranges and coalesce overlapping or adjacent ones"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class Segment:
+    """Byte range [start, end) of the output file.
+
+    pos is the next byte to claim for reading, written the first byte not yet
+    on disk; a failed request resumes from written.
+    """
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.written = start
+
+
+class SegmentQueue:
+    """Hand out download segments to connections, splitting slow tails.
+
+    The file is cut into SEGMENT_SIZE ranges that idle connections pull in
+    order, so fast connections simply do more of them. Once none are left,
+    an idle connection steals the back half of the active segment with the
+    most bytes remaining, so one slow connection can't hold up the end of the
+    download. The unwritten rest of a segment whose connection gives up goes
+    back in the queue for the others.
+    """
+
+    def __init__(self, total_size: int, done: list[tuple[int, int]] = (), segment_size: int = SEGMENT_SIZE):
+        self.total_size = total_size
+        self.lock = threading.Condition()
+        self.done = merge_ranges(done)
+        self.pending = deque()
+        for gap_start, gap_end in self.missing(total_size):
+            self.pending.extend(Segment(start, min(start + segment_size, gap_end))
+                                for start in range(gap_start, gap_end, segment_size))
+        self.active = set()
+        self.downloaded = sum(end - start for start, end in self.done)
+        self.finished = 0
+        self.steals = 0
+        self.aborted = False
+
+    def missing(self, total_size: int) -> list[tuple[int, int]]:
+        """Ranges of [0, total_size) not covered by done"""
+        gaps = []
+        pos = 0
+        for start, end in self.done + [(total_size, total_size)]:
+            if start > pos:
+                gaps.append((pos, start))
+            pos = max(pos, end)
+        return gaps
+
+    def completed(self) -> list[tuple[int, int]]:
+        """Ranges written to disk so far, including the head of in-flight segments"""
+        with self.lock:
+            return merge_ranges(self.done + [(s.start, s.written) for s in self.active if s.written > s.start])
+
+    def next(self) -> Optional[Segment]:
+        """Return the next segment to download, or None when nothing is left.
+
+        With nothing to hand out but segments still in flight, waits: one of
+        them may fail and come back.
+        """
+        with self.lock:
+            while not self.pending:
+                if self.aborted:
+                    return None
+                victim = max(self.active, key=lambda s: s.end - s.pos, default=None)
+                if victim is None:
+                    return None
+                if victim.end - victim.pos >= 2 * MIN_SPLIT_SIZE:
+                    middle = victim.pos + (victim.end - victim.pos) // 2
+                    segment = Segment(middle, victim.end)
+                    victim.end = middle
+                    self.steals += 1
+                    break
+                self.lock.wait()
+            else:
+                segment = self.pending.popleft()
+            self.active.add(segment)
+            return segment
+
+    def abort(self):
+        """Stop every connection after its current read and hand out nothing more"""
+        with self.lock:
+            self.aborted = True
+            self.pending.clear()
+            for segment in self.active:
+                segment.end = segment.pos
+            self.lock.notify_all()
+
+    def claim(self, segment: Segment, length: int) -> tuple[int, int]:
+        """Reserve up to length bytes at the head of segment; returns (offset, length)"""
+        with self.lock:
+            offset = segment.pos
+            length = max(0, min(length, segment.end - offset))
+            segment.pos += length
+            return offset, length
+
+    def remaining(self, segment: Segment) -> int:
+        with self.lock:
+            return segment.end - segment.pos
+
+    def commit(self, segment: Segment, length: int):
+        """Record length claimed bytes as written to disk"""
+        with self.lock:
+            segment.written += length
+            self.downloaded += length
+
+    def rewind(self, segment: Segment) -> int:
+        """Drop claims that never reached disk; returns the bytes left to fetch"""
+        with self.lock:
+            segment.pos = segment.written
+            return segment.end - segment.pos
+
+    def finish(self, segment: Segment, requeue: bool = False) -> int:
+        """Retire a segment; with requeue, its unwritten rest goes back in the queue.
+
+        Returns the number of bytes requeued.
+        """
+        with self.lock:
+            self.active.discard(segment)
+            requeued = segment.end - segment.written if requeue and not self.aborted else 0
+            if requeued > 0:
+                self.pending.append(Segment(segment.written, segment.end))
+                segment.end = segment.written
+            if segment.written > segment.start:
+                self.done = merge_ranges(self.done + [(segment.start, segment.written)])
+            self.finished += 1
+            self.lock.notify_all()
+            return requeued
+
+
+def download_segment(url: str, segment: Segment, output_path: Path, segments: SegmentQueue,
+                     etag: Optional[str] = None) -> bool:
+    """Download the rest of a segment and write it in place, stopping early if its tail is stolen"""
     try:
         req = Request(url)
         req.add_header('User-Agent', USER_AGENT)
-        req.add_header('Range', f'bytes={start}-{end}')
-
-        with urlopen(req, timeout=DOWNLOAD_TIMEOUT) as response:
+        req.add_header('Range', f'bytes={segment.pos}-{segment.end - 1}')
+        # A changed file comes back as a full 200 response instead of a mismatched range.
+        # Weak validators are not allowed in If-Range (RFC 9110) and would always get a 200.
+        if_range = etag is not None and not etag.startswith('W/')
+        if if_range:
+            req.add_header('If-Range', etag)
+
+        # Unbuffered, so bytes committed to the queue are already with the OS when the journal syncs
+        with urlopen(req, timeout=DOWNLOAD_TIMEOUT) as response, open(output_path, 'r+b', buffering=0) as f:
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if (response.status == 200 and if_range) or (response.status == 206 and total != str(segments.total_size)):
+                # The file changed on the server; retrying can't help and the pieces won't fit together
+                segments.abort()
+                return False
             if response.status != 206:
                 return False
 
-            downloaded = 0
-            total_chunk_size = end - start + 1
+            while (remaining := segments.remaining(segment)) > 0:
+                data = response.read(min(SEGMENT_READ_SIZE, remaining))
+                if not data:
+                    return False
 
-            # Open file for this thread (each thread has its own file handle)
-            with open(output_path, 'r+b') as f:
-                # Seek to starting position
-                f.seek(start)
+                # The end may have moved while reading; drop bytes now owned by another connection
+                offset, length = segments.claim(segment, len(data))
+                f.seek(offset)
+                f.write(data[:length])
+                segments.commit(segment, length)
 
-                while downloaded < total_chunk_size:
-                    to_read = min(CHUNK_SIZE, total_chunk_size - downloaded)
-                    data = response.read(to_read)
-
-                    if not data:
-                        break
+            return True
 
-                    # Write to disk immediately (file handles are independent, seek isolates writes)
-                    f.write(data)
-                    downloaded += len(data)
+    except (URLError, HTTPError, IOError):
+        return False
 
-                    # Update progress tracker (thread-safe)
-                    with lock:
-                        progress_tracker[chunk_id] = downloaded
 
-            return downloaded == total_chunk_size
+def fetch_segment(url: str, segment: Segment, output_path: Path, segments: SegmentQueue,
+                  retries: int, etag: Optional[str] = None) -> bool:
+    """Download a segment, re-requesting the unwritten remainder with backoff on errors.
 
-    except (URLError, HTTPError, IOError) as e:
+    Once the retries are used up the remainder is handed back to the queue
+    for another connection.
+    """
+    ok = False
+    try:
+        for attempt in range(retries + 1):
+            if segments.aborted:
+                return False
+            if attempt:
+                remaining = segments.rewind(segment)
+                if remaining <= 0:
+                    return True
+                # Exponential backoff with jitter so connections hitting the same bad edge spread out
+                delay = min(RETRY_DELAY * 2 ** (attempt - 1), RETRY_DELAY_MAX) * random.uniform(0.5, 1.0)
+                print_warning(f"Segment at {segment.start / (1024**2):.0f} MB failed, resuming "
+                              f"{remaining / (1024**2):.1f} MB in {delay:.1f}s (retry {attempt}/{retries})")
+                time.sleep(delay)
+            if download_segment(url, segment, output_path, segments, etag):
+                ok = True
+                return True
         return False
+    finally:
+        requeued = segments.finish(segment, requeue=not ok)
+        if requeued:
+            print_warning(f"Giving up on this connection, {requeued / (1024**2):.1f} MB "
+                          f"handed to the others")
 
 
 def download_file_multiconnection(url: str, output_path: Path, total_size: int,
-                                   num_connections: int) -> bool:
-    """Download file using multiple parallel connections with streaming to disk"""
+                                   num_connections: int, retries: int = RETRIES,
+                                   etag: Optional[str] = None) -> bool:
+    """Download file using multiple parallel connections with streaming to disk
+
+    Finished ranges are journaled next to the output file, so a download
+    interrupted by an error or a crash resumes where it stopped.
+    """
     print_info(f"Using {num_connections} parallel connections")
 
-    # Pre-allocate file with correct size
-    try:
-        with open(output_path, 'wb') as f:
-            f.seek(total_size - 1)
-            f.write(b'\0')
-    except IOError as e:
-        print_error(f"Failed to create output file: {e}")
-        return False
+    done = load_journal(output_path, url, total_size, etag)
+    if done:
+        print_info(f"Resuming partial download ({sum(end - start for start, end in done) / (1024**2):.1f} MB already done)")
+    else:
+        # Pre-allocate file with correct size
+        try:
+            with open(output_path, 'wb') as f:
+                f.seek(total_size - 1)
+                f.write(b'\0')
+        except IOError as e:
+            print_error(f"Failed to create output file: {e}")
+            return False
 
-    # Calculate byte ranges for each connection
-    chunk_size = total_size // num_connections
-    ranges = []
+    segments = SegmentQueue(total_size, done)
 
-    for i in range(num_connections):
-        start = i * chunk_size
-        # Last chunk gets any remaining bytes
-        end = total_size - 1 if i == num_connections - 1 else (i + 1) * chunk_size - 1
-        ranges.append((start, end))
+    def checkpoint():
+        if not segments.aborted:
+            save_journal(output_path, url, total_size, etag, segments.completed())
 
-    # Progress tracking
-    progress_tracker = {i: 0 for i in range(num_connections)}
-    lock = threading.Lock()
-    results = {}
+    checkpoint()
 
-    def worker(chunk_id: int, start: int, end: int):
-        """Worker thread for downloading a chunk"""
-        success = download_chunk(url, start, end, output_path, chunk_id, progress_tracker, lock)
-        with lock:
-            results[chunk_id] = success
+    def worker():
+        """Pull segments until none are left, or until this connection keeps failing"""
+        while segment := segments.next():
+            if not fetch_segment(url, segment, output_path, segments, retries, etag):
+                return
 
     # Start all download threads
     threads = []
-    for i, (start, end) in enumerate(ranges):
-        thread = threading.Thread(target=worker, args=(i, start, end))
+    for _ in range(num_connections):
+        # Daemon threads let Ctrl-C exit; the journal keeps what was already written
+        thread = threading.Thread(target=worker, daemon=True)
         thread.start()
         threads.append(thread)
 
-    # Progress display
+    # Progress display, saving the journal as segments finish and periodically in between
     last_percent_reported = -10.0
+    last_finished = 0
+    last_checkpoint = time.monotonic()
 
-    while any(t.is_alive() for t in threads):
-        with lock:
-            total_downloaded = sum(progress_tracker.values())
-        last_percent_reported = display_progress(total_downloaded, total_size, last_percent_reported)
-        time.sleep(0.2)
-
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
+    try:
+        while any(t.is_alive() for t in threads):
+            last_percent_reported = display_progress(segments.downloaded, total_size, last_percent_reported)
+            if segments.finished != last_finished or time.monotonic() - last_checkpoint >= JOURNAL_INTERVAL:
+                last_finished = segments.finished
+                last_checkpoint = time.monotonic()
+                checkpoint()
+            time.sleep(0.2)
+
+        # Wait for all threads to complete
+        for thread in threads:
+            thread.join()
+    finally:
+        checkpoint()
 
     # Final progress update
-    with lock:
-        total_downloaded = sum(progress_tracker.values())
+    total_downloaded = segments.downloaded
     display_progress(total_downloaded, total_size, last_percent_reported)
     if IS_INTERACTIVE:
         print()  # New line after progress bar
-
-    # Check if all chunks downloaded successfully
-    all_success = all(results.values()) if results else False
-
-    if all_success and total_downloaded == total_size:
+    if segments.steals:
+        print_info(f"Split {segments.steals} slow segment tail(s) across idle connections")
+
+    if segments.aborted:
+        # Parts of two versions can't be resumed: start over next time
+        print_error("File changed on the server during the download, run again to start over")
+        journal_path(output_path).unlink(missing_ok=True)
+        output_path.unlink(missing_ok=True)
+        return False
+    elif total_downloaded == total_size:
+        journal_path(output_path).unlink(missing_ok=True)
         return True
     else:
         print_error(f"Download incomplete: {total_downloaded}/{total_size} bytes")
+        print_info("Run the same command again to resume")
         return False
 
 
-def download_file(url: str, filename: str, expected_md5: Optional[str] = None, no_clobber: bool = False, num_connections: int = 1) -> bool:
+def download_file(url: str, filename: str, expected_md5: Optional[str] = None, no_clobber: bool = False, num_connections: int = 1,
+                  retries: int = RETRIES) -> bool:
     """Download file with progress bar and optional MD5 verification"""
     print_header("Step 5: Downloading firmware...")
 
     output_path = Path(filename)
+    resumable = output_path.exists() and journal_path(output_path).exists()
 
     # Check if file already exists
-    if output_path.exists():
+    if resumable:
+        print_info(f"Found partial download: {output_path}")
+    elif output_path.exists():
         print_info(f"File already exists: {output_path}")
 
         # If no-clobber is set, skip download
@@ -393,9 +640,12 @@ def download_file(url: str, filename: str, expected_md5: Optional[str] = None, n
     use_multiconnection = False
     total_size = 0
 
-    if num_connections > 1:
+    etag = None
+
+    # A partial download can only be resumed with range requests, even over one connection
+    if num_connections > 1 or resumable:
         print_info(f"Checking server support for multi-connection downloads...")
-        supports_range, file_size = check_range_support(url)
+        supports_range, file_size, etag = check_range_support(url)
         total_size = file_size
 
         if supports_range and file_size > 0:
@@ -408,7 +658,7 @@ def download_file(url: str, filename: str, expected_md5: Optional[str] = None, n
     try:
         if use_multiconnection:
             # Multi-connection download
-            success = download_file_multiconnection(url, output_path, total_size, num_connections)
+            success = download_file_multiconnection(url, output_path, total_size, num_connections, retries, etag)
             if not success:
                 print_error("Multi-connection download failed")
                 return False
@@ -434,6 +684,7 @@ def download_file(url: str, filename: str, expected_md5: Optional[str] = None, n
 
             if IS_INTERACTIVE:
                 print()  # New line after progress bar
+            journal_path(output_path).unlink(missing_ok=True)
             print_success(f"Download complete: {output_path}")
 
         # Verify MD5 if provided
@@ -510,6 +761,17 @@ def get_firmware_info(device_name: str, variant: str) -> Optional[dict]:
     return firmware
 
 
+def non_negative_int(value: str) -> int:
+    """argparse type for counts that may be zero"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'") from None
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {number}")
+    return number
+
+
 def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(
@@ -561,6 +823,13 @@ Supported variants:
         metavar='N',
         help='Number of parallel connections (1-16, default: 1)'
     )
+    parser.add_argument(
+        '--retries',
+        type=non_negative_int,
+        default=RETRIES,
+        metavar='N',
+        help=f'Retries per segment on connection errors with multiple connections (default: {RETRIES})'
+    )
     parser.add_argument(
         '--check-only',
         action='store_true',
@@ -664,7 +933,8 @@ def main():
         filename = str(args.output_dir / filename)
 
     # Step 5-6: Download and verify
-    success = download_file(download_url, filename, md5sum, args.no_clobber, args.num_connections)
+    success = download_file(download_url, filename, md5sum, args.no_clobber, args.num_connections,
+                            args.retries)
 
     if success:
         done_symbol = "✓" if IS_INTERACTIVE else ""
@@ -5,18 +5,58 @@ Extracts partition images from OTA payload.bin files (Brillo/AOSP format)
 No external dependencies - uses only Python standard library
 """
 
+import io
+import os
 import sys
+import mmap
 import struct
 import lzma
 import bz2
 import hashlib
+import json
+import base64
+import time
+import queue
+import threading
 import argparse
+import zipfile
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
 from pathlib import Path
+from http.client import HTTPException
+from urllib.request import Request, urlopen
 from dataclasses import dataclass, field
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 PAYLOAD_MAGIC = b'CrAU'
+ZIP_MAGIC = b'PK\x03\x04'
+ZIP_PAYLOAD_NAME = 'payload.bin'
 BLOCK_SIZE = 4096
 
+VERIFY_MODES = ('none', 'ops', 'full')
+PROGRESS_MODES = ('auto', 'bar', 'log', 'json', 'none')
+PROGRESS_INTERVAL = {'bar': 0.2, 'log': 10.0, 'json': 1.0}  # seconds between reports
+
+IS_INTERACTIVE = sys.stdout.isatty()
+
+INDEX_CACHE_VERSION = 3
+INDEX_CACHE_SIZE = 64  # MB
+BLOB_CACHE_SIZE = 1024  # MB
+
+DECODE_CHUNK_SIZE = 1024 * 1024  # decompressed bytes produced per step, per worker
+PIPELINE_DEPTH = 2  # queued blobs and write batches per decode thread
+PIPELINE_POLL = 0.1  # seconds between cancellation checks of a blocked stage
+OPEN_PARTITION_CACHE = 8  # decoded ops kept by Payload.open_partition readers
+WRITE_IOV_MAX = 1024  # buffers per pwritev call (POSIX IOV_MAX minimum on Linux)
+
+HTTP_USER_AGENT = 'Oxygen_updater_6.7.6'
+HTTP_TIMEOUT = 60
+HTTP_SKIP_LIMIT = 1024 * 1024  # read through gaps this small instead of reconnecting
+HTTP_RETRIES = 3  # reconnects per read after a dropped connection
+HTTP_RETRY_DELAY = 1.0  # seconds before the first reconnect, doubled after each
+
 OP_REPLACE = 0
 OP_REPLACE_BZ = 1
 OP_SOURCE_COPY = 4
@@ -24,6 +64,17 @@ OP_SOURCE_BSDIFF = 5
 OP_ZERO = 6
 OP_REPLACE_XZ = 8
 OP_PUFFDIFF = 9
+OP_ZSTD = 14
+OP_LZ4 = 15
+
+# PUFFDIFF is not among them: it needs bit-exact deflate re-encoding (puffin), which isn't implemented
+INCREMENTAL_OPS = (OP_SOURCE_COPY, OP_SOURCE_BSDIFF)
+# Ops whose decoded output is worth keeping: REPLACE, ZERO and SOURCE_COPY are no cheaper to redo
+BLOB_CACHE_OPS = (OP_REPLACE_BZ, OP_REPLACE_XZ, OP_ZSTD, OP_LZ4, OP_SOURCE_BSDIFF)
+
+BSDIFF_MAGIC = b'BSDIFF40'
+BSDF2_MAGIC = b'BSDF2'
+BSDIFF_BROTLI = 2  # BSDF2 stream compressor ids: 0 none, 1 bzip2, 2 brotli
 
 OP_NAMES = {
     0: 'REPLACE', 1: 'REPLACE_BZ', 4: 'SOURCE_COPY', 5: 'SOURCE_BSDIFF',
@@ -38,27 +89,185 @@ class Operation:
     data_length: int = 0
     dst_extents: list = field(default_factory=list)  # list of (start_block, num_blocks)
     data_sha256: bytes = b''
+    src_extents: list = field(default_factory=list)  # incremental ops: blocks of the source image
+    src_sha256: bytes = b''
+
+
+class OperationTable:
+    """Column-oriented storage for a partition's operations.
+
+    Holds the same data as a list of Operation objects in a handful of
+    array.array columns plus a flat extent table, so large partitions cost a
+    few bytes per op instead of several Python objects. Iteration and
+    indexing yield transient Operation objects, so it is a drop-in
+    replacement wherever a list of operations is read.
+    """
+
+    HASH_SIZE = 32
+
+    def __init__(self, operations=()):
+        self.op_type = array('B')
+        self.data_offset = array('Q')
+        self.data_length = array('Q')
+        self.hash_index = array('l')  # index into hashes, -1 if the op has no hash
+        self.src_hash_index = array('l')
+        self.hashes = bytearray()
+        self.extent_index = array('L', [0])  # op i owns extents[extent_index[i]:extent_index[i + 1]]
+        self.extents = array('Q')  # flat start_block, num_blocks pairs
+        self.src_extent_index = array('L', [0])
+        self.src_extents = array('Q')
+        for op in operations:
+            self.append(op)
+
+    def _append_hash(self, index: array, digest: bytes):
+        if digest:
+            index.append(len(self.hashes) // self.HASH_SIZE)
+            self.hashes += digest
+        else:
+            index.append(-1)
+
+    def _get_hash(self, index: array, i: int) -> bytes:
+        h = index[i]
+        return bytes(self.hashes[h * self.HASH_SIZE:(h + 1) * self.HASH_SIZE]) if h >= 0 else b''
+
+    @staticmethod
+    def _append_extents(index: array, flat: array, extents: list):
+        for start, num in extents:
+            flat.append(start)
+            flat.append(num)
+        index.append(len(flat))
+
+    @staticmethod
+    def _get_extents(index: array, flat: array, i: int) -> list:
+        pairs = flat[index[i]:index[i + 1]]
+        return list(zip(pairs[::2], pairs[1::2]))
+
+    def append(self, op: Operation):
+        self.op_type.append(op.op_type)
+        self.data_offset.append(op.data_offset)
+        self.data_length.append(op.data_length)
+        self._append_hash(self.hash_index, op.data_sha256)
+        self._append_hash(self.src_hash_index, op.src_sha256)
+        self._append_extents(self.extent_index, self.extents, op.dst_extents)
+        self._append_extents(self.src_extent_index, self.src_extents, op.src_extents)
+
+    COLUMNS = ('op_type', 'data_offset', 'data_length', 'hash_index', 'src_hash_index',
+               'extent_index', 'extents', 'src_extent_index', 'src_extents')
+
+    def to_dict(self) -> dict:
+        """Serialize columns as base64 of their native machine representation"""
+        out = {name: base64.b64encode(getattr(self, name).tobytes()).decode() for name in self.COLUMNS}
+        out['hashes'] = base64.b64encode(self.hashes).decode()
+        return out
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'OperationTable':
+        table = cls()
+        for name in cls.COLUMNS:
+            column = array(getattr(table, name).typecode)
+            column.frombytes(base64.b64decode(data[name]))
+            setattr(table, name, column)
+        table.hashes = bytearray(base64.b64decode(data['hashes']))
+        return table
+
+    def __len__(self) -> int:
+        return len(self.op_type)
+
+    def __getitem__(self, i: int) -> Operation:
+        if i < 0:
+            i += len(self)
+        return Operation(
+            op_type=self.op_type[i],
+            data_offset=self.data_offset[i],
+            data_length=self.data_length[i],
+            dst_extents=self._get_extents(self.extent_index, self.extents, i),
+            data_sha256=self._get_hash(self.hash_index, i),
+            src_extents=self._get_extents(self.src_extent_index, self.src_extents, i),
+            src_sha256=self._get_hash(self.src_hash_index, i),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
 
 @dataclass
 class Partition:
     name: str = ''
-    operations: list = field(default_factory=list)
     size: int = 0
+    hash: bytes = b''  # SHA-256 of the full image (new_partition_info)
+    num_operations: int = 0
+    manifest: bytes = field(default=b'', repr=False)
+    span: tuple = (0, 0)  # byte range of the PartitionUpdate message in manifest
+    compact: bool = False  # decode operations into an OperationTable
+    _operations: list = field(default=None, repr=False)
+
+    @property
+    def record(self) -> memoryview:
+        """Raw PartitionUpdate message"""
+        return memoryview(self.manifest)[self.span[0]:self.span[1]]
+
+    @property
+    def operations(self) -> list:
+        """Operations, decoded from the raw record on first access"""
+        if self._operations is None:
+            self._operations = parse_operations(self.manifest, *self.span, compact=self.compact)
+        return self._operations
+
+    @operations.setter
+    def operations(self, operations: list):
+        self._operations = operations
+        self.num_operations = len(operations)
+
+
+@dataclass
+class ExtractOptions:
+    jobs: int = 1  # decode threads
+    sparse: bool = True  # leave zero blocks as holes
+    source_dir: Path = None  # previous images for incremental payloads
+    verify: str = 'ops'  # none, ops (op data and source hashes) or full (ops + partition hashes)
+    progress: str = 'auto'  # bar on a TTY, log lines otherwise; json for JSON-lines events
+    blob_cache: Path = None  # directory of decoded op output keyed by data_sha256
+    blob_cache_size: int = BLOB_CACHE_SIZE  # MB
+    hooks: list = field(default_factory=list)  # callables receiving a StageEvent per op and stage
 
 
 @dataclass
 class Payload:
     path: Path = None
+    base_offset: int = 0  # offset of payload.bin inside its container (OTA zip)
     data_offset: int = 0
     block_size: int = BLOCK_SIZE
     partitions: list = field(default_factory=list)
 
+    def open_partition(self, name: str, source: Path | None = None, verify: bool = True) -> 'PartitionFile':
+        """Open a partition as a seekable read-only file, decoding ops on demand.
+
+        source is the previous image, needed when the partition is incremental.
+        """
+        for part in self.partitions:
+            if part.name == name:
+                return PartitionFile(self, part, source, verify)
+        raise ValueError(f"Partition '{name}' not found")
+
 
 def read_varint(data: bytes, pos: int) -> tuple[int, int]:
     """Read varint, return (value, new_position)"""
-    result = 0
-    shift = 0
+    # Tags, field numbers and extent sizes are almost always 1-2 bytes
+    try:
+        byte = data[pos]
+        if byte < 0x80:
+            return byte, pos + 1
+        result = byte & 0x7F
+        byte = data[pos + 1]
+        if byte < 0x80:
+            return result | byte << 7, pos + 2
+    except IndexError:
+        raise ValueError("Truncated varint") from None
+
+    result |= (byte & 0x7F) << 7
+    shift = 14
+    pos += 2
     while pos < len(data):
         byte = data[pos]
         pos += 1
@@ -69,74 +278,288 @@ def read_varint(data: bytes, pos: int) -> tuple[int, int]:
     raise ValueError("Truncated varint")
 
 
-def iter_fields(data: bytes):
-    """Iterate protobuf fields, yielding (field_number, value)"""
-    pos = 0
-    while pos < len(data):
+def skip_field(data: bytes, pos: int, wire_type: int) -> int:
+    """Skip over a field value, return the position after it"""
+    if wire_type == 0:
+        return read_varint(data, pos)[1]
+    if wire_type == 2:
+        length, pos = read_varint(data, pos)
+        return pos + length
+    if wire_type == 1:
+        return pos + 8
+    if wire_type == 5:
+        return pos + 4
+    raise ValueError(f"Unknown wire type: {wire_type}")
+
+
+def iter_field_offsets(data: bytes, pos: int = 0, end: int | None = None):
+    """Iterate protobuf fields in data[pos:end] without copying.
+
+    Yields (field_number, wire_type, value, offset). For length-delimited
+    fields value is the length and offset is where the bytes start; for the
+    other wire types value is the decoded integer.
+    """
+    if end is None:
+        end = len(data)
+    while pos < end:
         tag, pos = read_varint(data, pos)
-        field_num = tag >> 3
         wire_type = tag & 7
 
         if wire_type == 0:  # varint
             value, pos = read_varint(data, pos)
+            yield tag >> 3, 0, value, pos
         elif wire_type == 2:  # length-delimited
             length, pos = read_varint(data, pos)
-            value = data[pos:pos + length]
+            yield tag >> 3, 2, length, pos
             pos += length
         elif wire_type == 1:  # 64-bit
-            value = struct.unpack('<Q', data[pos:pos + 8])[0]
+            yield tag >> 3, 1, struct.unpack_from('<Q', data, pos)[0], pos
             pos += 8
         elif wire_type == 5:  # 32-bit
-            value = struct.unpack('<I', data[pos:pos + 4])[0]
+            yield tag >> 3, 5, struct.unpack_from('<I', data, pos)[0], pos
             pos += 4
         else:
             raise ValueError(f"Unknown wire type: {wire_type}")
 
+    if pos > end:
+        raise ValueError("Truncated message")
+
+
+def iter_fields(data: bytes):
+    """Iterate protobuf fields, yielding (field_number, value)"""
+    for field_num, wire_type, value, pos in iter_field_offsets(data):
+        if wire_type == 2:
+            value = data[pos:pos + value]
         yield field_num, value
 
 
-def parse_operation(data: bytes) -> Operation:
-    """Parse InstallOperation message"""
+def parse_extent(data: bytes, pos: int, end: int) -> tuple[int, int]:
+    """Parse Extent message in data[pos:end], return (start_block, num_blocks)"""
+    start = num = 0
+    while pos < end:
+        tag = data[pos]
+        pos += 1
+        if tag == 0x08:  # start_block, varint
+            start, pos = read_varint(data, pos)
+        elif tag == 0x10:  # num_blocks, varint
+            num, pos = read_varint(data, pos)
+        else:
+            tag, pos = read_varint(data, pos - 1)
+            pos = skip_field(data, pos, tag & 7)
+    return start, num
+
+
+def parse_operation(data: bytes, pos: int = 0, end: int | None = None) -> Operation:
+    """Parse InstallOperation message in data[pos:end]"""
+    if end is None:
+        end = len(data)
     op = Operation()
-    for field_num, value in iter_fields(data):
-        if field_num == 1:
-            op.op_type = value
-        elif field_num == 2:
-            op.data_offset = value
-        elif field_num == 3:
-            op.data_length = value
-        elif field_num == 6:  # dst_extent
-            start = num = 0
-            for f, v in iter_fields(value):
-                if f == 1:
-                    start = v
-                elif f == 2:
-                    num = v
-            op.dst_extents.append((start, num))
-        elif field_num == 8:
-            op.data_sha256 = value
+    extents = op.dst_extents
+
+    # Hand-inlined field loop with 1-byte tag/varint fast paths: this runs
+    # once per op of every decoded partition
+    while pos < end:
+        tag = data[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = read_varint(data, pos)
+
+        if tag == 0x32:  # dst_extent
+            length = data[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = read_varint(data, pos)
+            extents.append(parse_extent(data, pos, pos + length))
+            pos += length
+        elif tag == 0x08:  # type
+            op.op_type = data[pos]
+            if op.op_type < 0x80:
+                pos += 1
+            else:
+                op.op_type, pos = read_varint(data, pos)
+        elif tag == 0x10:  # data_offset
+            op.data_offset, pos = read_varint(data, pos)
+        elif tag == 0x18:  # data_length
+            op.data_length, pos = read_varint(data, pos)
+        elif tag == 0x42:  # data_sha256_hash
+            length = data[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = read_varint(data, pos)
+            op.data_sha256 = bytes(data[pos:pos + length])
+            pos += length
+        elif tag == 0x22:  # src_extent
+            length, pos = read_varint(data, pos)
+            op.src_extents.append(parse_extent(data, pos, pos + length))
+            pos += length
+        elif tag == 0x4A:  # src_sha256_hash
+            length, pos = read_varint(data, pos)
+            op.src_sha256 = bytes(data[pos:pos + length])
+            pos += length
+        else:
+            pos = skip_field(data, pos, tag & 7)
     return op
 
 
-def parse_partition(data: bytes) -> Partition:
-    """Parse PartitionUpdate message"""
-    part = Partition()
-    for field_num, value in iter_fields(data):
+def parse_operations(data: bytes, pos: int = 0, end: int | None = None, compact: bool = False):
+    """Decode every operation of the PartitionUpdate message in data[pos:end].
+
+    Returns a list of Operation, or an OperationTable when compact is set.
+    """
+    ops = (parse_operation(data, offset, offset + length)
+           for field_num, wire_type, length, offset in iter_field_offsets(data, pos, end)
+           if field_num == 8 and wire_type == 2)
+    return OperationTable(ops) if compact else list(ops)
+
+
+def scan_partition(data: bytes, pos: int = 0, end: int | None = None, compact: bool = False) -> Partition:
+    """Read name, size and op count of the PartitionUpdate message in data[pos:end].
+
+    Operations are left undecoded until Partition.operations is accessed.
+    """
+    if end is None:
+        end = len(data)
+    part = Partition(manifest=data, span=(pos, end), compact=compact)
+    for field_num, wire_type, value, offset in iter_field_offsets(data, pos, end):
         if field_num == 1:
-            part.name = value.decode()
+            part.name = bytes(data[offset:offset + value]).decode()
         elif field_num == 7:  # new_partition_info
-            for f, v in iter_fields(value):
+            for f, w, v, o in iter_field_offsets(data, offset, offset + value):
                 if f == 1:
                     part.size = v
+                elif f == 2 and w == 2:
+                    part.hash = bytes(data[o:o + v])
         elif field_num == 8:  # operation
-            part.operations.append(parse_operation(value))
+            part.num_operations += 1
     return part
 
 
-def load_payload(path: Path) -> Payload:
-    """Load and parse payload.bin, return Payload object"""
-    with open(path, 'rb') as f:
+def parse_partition(data: bytes) -> Partition:
+    """Parse PartitionUpdate message, including all operations"""
+    part = scan_partition(data)
+    part.operations  # decode now
+    return part
+
+
+def find_zip_payload(f) -> int:
+    """Return the offset of the STORED payload.bin data inside an OTA zip"""
+    with zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.filename.rsplit('/', 1)[-1] == ZIP_PAYLOAD_NAME:
+                break
+        else:
+            raise ValueError(f"No {ZIP_PAYLOAD_NAME} in zip")
+
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{info.filename} is compressed in zip, extract it first")
+
+    # The central directory does not record where the data starts; the
+    # local file header's name and extra field lengths can differ from it
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != ZIP_MAGIC:
+        raise ValueError(f"Bad local file header for {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def source_stat(f) -> tuple[int, int]:
+    """Return (size, mtime_ns) of an open payload source"""
+    if isinstance(f, HttpFile):
+        return f.size, 0
+    st = os.fstat(f.fileno())
+    return st.st_size, st.st_mtime_ns
+
+
+def evict_cache(cache_dir: Path, max_bytes: int, pattern: str = '*'):
+    """Delete least recently used cache files until the total fits max_bytes"""
+    entries = []
+    for path in cache_dir.glob(pattern):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue  # removed by a concurrent run
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def index_signature() -> dict:
+    """Describe the array layout so caches from other platforms are rejected"""
+    table = OperationTable()
+    return {
+        'version': INDEX_CACHE_VERSION,
+        'byteorder': sys.byteorder,
+        'itemsizes': [getattr(table, name).itemsize for name in OperationTable.COLUMNS],
+    }
+
+
+def load_index(cache_dir: Path, key: str, source: tuple[int, int]) -> dict | None:
+    """Return the cached manifest index for key, or None on a miss"""
+    path = cache_dir / f"{key}.json"
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('signature') != index_signature() or index.get('source') != list(source):
+        return None
+
+    try:
+        os.utime(path)  # mark as recently used for eviction
+    except OSError:
+        pass  # e.g. an entry owned by another user in a shared cache
+    return index
+
+
+def store_index(cache_dir: Path, key: str, source: tuple[int, int], payload: Payload,
+                max_bytes: int = INDEX_CACHE_SIZE * 1024 * 1024):
+    """Write the parsed manifest of payload to the cache directory"""
+    index = {
+        'signature': index_signature(),
+        'source': list(source),
+        'block_size': payload.block_size,
+        'partitions': [{
+            'name': part.name,
+            'size': part.size,
+            'hash': part.hash.hex(),
+            'operations': OperationTable(part.operations).to_dict(),
+        } for part in payload.partitions],
+    }
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = cache_dir / f".{key}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp, cache_dir / f"{key}.json")
+    evict_cache(cache_dir, max_bytes, '*.json')
+
+
+def load_payload(path: Path | str, compact: bool = False, cache_dir: Path | None = None,
+                 cache_size: int = INDEX_CACHE_SIZE) -> Payload:
+    """Load and parse payload.bin (bare or inside an OTA zip), return Payload object.
+
+    With compact=True partitions store their operations in an OperationTable.
+    With cache_dir, the parsed partition and op tables are kept in an on-disk
+    index keyed by the manifest SHA-256, validated against the source size and
+    mtime, so later runs skip manifest parsing.
+    """
+    with open_source(path) as f:
+        base = 0
         magic = f.read(4)
+        if magic == ZIP_MAGIC:
+            base = find_zip_payload(f)
+            f.seek(base)
+            magic = f.read(4)
         if magic != PAYLOAD_MAGIC:
             raise ValueError(f"Invalid magic: {magic!r}")
 
@@ -147,71 +570,1483 @@ def load_payload(path: Path) -> Payload:
         manifest_size = struct.unpack('>Q', f.read(8))[0]
         signature_size = struct.unpack('>I', f.read(4))[0]
         manifest_data = f.read(manifest_size)
+        source = source_stat(f)
+
+    payload = Payload(path=path, base_offset=base,
+                      data_offset=base + 24 + manifest_size + signature_size)
 
-    payload = Payload(path=path, data_offset=24 + manifest_size + signature_size)
+    if cache_dir is not None:
+        key = hashlib.sha256(manifest_data).hexdigest()
+        index = load_index(cache_dir, key, source)
+        if index is not None:
+            payload.block_size = index['block_size']
+            for entry in index['partitions']:
+                table = OperationTable.from_dict(entry['operations'])
+                payload.partitions.append(Partition(
+                    name=entry['name'], size=entry['size'], hash=bytes.fromhex(entry['hash']),
+                    num_operations=len(table),
+                    compact=True, _operations=table))
+            return payload
 
-    for field_num, value in iter_fields(manifest_data):
+    # Partitions keep a reference to the manifest and their record's span
+    # instead of a copy of the record
+    for field_num, wire_type, value, offset in iter_field_offsets(manifest_data):
         if field_num == 3:
             payload.block_size = value
         elif field_num == 13:
-            payload.partitions.append(parse_partition(value))
+            payload.partitions.append(scan_partition(manifest_data, offset, offset + value, compact))
+
+    if cache_dir is not None:
+        try:
+            store_index(cache_dir, key, source, payload, cache_size * 1024 * 1024)
+        except OSError as e:
+            print(f"Warning: could not write index cache: {e}", file=sys.stderr)
 
     return payload
 
 
-def decompress(data: bytes, op_type: int) -> bytes:
-    """Decompress data based on operation type"""
+def lz4_block_decompress(data: bytes, output_size: int) -> bytes:
+    """Decode an LZ4 block (no frame header) in pure Python"""
+    src = bytes(data)
+    out = bytearray()
+    pos = 0
+    end = len(src)
+    try:
+        while pos < end:
+            token = src[pos]
+            pos += 1
+
+            length = token >> 4
+            if length == 15:
+                while True:
+                    byte = src[pos]
+                    pos += 1
+                    length += byte
+                    if byte != 255:
+                        break
+            if pos + length > end:
+                raise IndexError
+            out += src[pos:pos + length]
+            pos += length
+            if pos >= end:
+                break  # the last sequence carries literals only
+
+            offset = src[pos] | src[pos + 1] << 8
+            pos += 2
+            length = token & 15
+            if length == 15:
+                while True:
+                    byte = src[pos]
+                    pos += 1
+                    length += byte
+                    if byte != 255:
+                        break
+            length += 4
+
+            start = len(out) - offset
+            if offset == 0 or start < 0:
+                raise ValueError("Invalid LZ4 match offset")
+            if offset >= length:
+                out += out[start:start + length]
+            else:  # overlapping match repeats the last offset bytes
+                reps, rest = divmod(length, offset)
+                pattern = out[start:]
+                out += pattern * reps + pattern[:rest]
+    except IndexError:
+        raise ValueError("Truncated LZ4 block") from None
+
+    if len(out) > output_size:
+        raise ValueError("LZ4 block larger than destination extents")
+    return bytes(out)
+
+
+class LZ4BlockDecompressor:
+    """LZ4 block decoder with the LZMADecompressor streaming interface.
+
+    The block format carries no framing, so the blob is decoded in one step
+    (by the lz4 package when installed) and then handed out in chunks.
+    """
+
+    def __init__(self, output_size: int):
+        self.output_size = output_size
+        self.buffer = None
+        self.pos = 0
+        self.eof = False
+        self.needs_input = True
+        self.unused_data = b''
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        if self.buffer is None:
+            try:
+                import lz4.block
+                decoded = lz4.block.decompress(data, uncompressed_size=self.output_size)
+            except ImportError:
+                decoded = lz4_block_decompress(data, self.output_size)
+            self.buffer = memoryview(decoded)
+            self.needs_input = False
+
+        end = len(self.buffer) if max_length < 0 else self.pos + max_length
+        chunk = self.buffer[self.pos:end]
+        self.pos += len(chunk)
+        self.eof = self.pos >= len(self.buffer)
+        return chunk
+
+
+class ZstandardDecompressor:
+    """Adapter giving the zstandard package's stream reader the LZMADecompressor interface.
+
+    The blob is decoded max_length bytes at a time straight from the caller's
+    buffer, so memory stays bounded by one chunk. The reader reports a
+    truncated stream as a short read, hence the check against output_size.
+    """
+
+    def __init__(self, output_size: int = -1):
+        import zstandard
+        self.dctx = zstandard.ZstdDecompressor()
+        self.output_size = output_size
+        self.reader = None
+        self.produced = 0
+        self.eof = False
+        self.needs_input = True
+        self.unused_data = b''
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes:
+        if self.reader is None:
+            self.reader = self.dctx.stream_reader(data, read_across_frames=True)
+            self.needs_input = False
+        chunk = self.reader.read(max_length)
+        self.produced += len(chunk)
+        if not chunk or max_length < 0:
+            self.eof = True
+            if self.produced < self.output_size:
+                raise ValueError("Compressed data ended before the end-of-stream marker")
+        return chunk
+
+
+def zstd_decompressor(output_size: int):
+    """Create a ZSTD decompressor from the stdlib, falling back to zstandard"""
+    try:
+        from compression import zstd
+        return zstd.ZstdDecompressor()
+    except ImportError:
+        pass
+    try:
+        return ZstandardDecompressor(output_size)
+    except ImportError:
+        raise ValueError("ZSTD ops need Python 3.14+ (compression.zstd) or the zstandard package") from None
+
+
+# Op type -> factory(output_size) returning a decompressor with the
+# LZMADecompressor interface: decompress(data, max_length), eof,
+# needs_input and unused_data. Backends are imported on first use.
+CODECS = {
+    OP_REPLACE_XZ: lambda output_size: lzma.LZMADecompressor(),
+    OP_REPLACE_BZ: lambda output_size: bz2.BZ2Decompressor(),
+    OP_ZSTD: zstd_decompressor,
+    OP_LZ4: LZ4BlockDecompressor,
+}
+
+
+def register_codec(op_type: int, factory):
+    """Register a streaming decompressor factory for an op type"""
+    CODECS[op_type] = factory
+
+
+def iter_decompressed(data: bytes, op_type: int, chunk_size: int = DECODE_CHUNK_SIZE,
+                      output_size: int = -1):
+    """Decompress data based on operation type, yielding chunks of at most chunk_size bytes.
+
+    output_size is the total size of the op's destination extents; codecs
+    without framing (LZ4 blocks) need it.
+    """
+    if op_type == OP_REPLACE:
+        view = memoryview(data)
+        for pos in range(0, len(view), chunk_size):
+            yield view[pos:pos + chunk_size]
+        return
+
+    factory = CODECS.get(op_type)
+    if factory is None:
+        raise ValueError(f"Unsupported: {OP_NAMES.get(op_type, op_type)}")
+
+    decompressor = factory(output_size)
+    while True:
+        chunk = decompressor.decompress(data, max_length=chunk_size)
+        data = b''
+        if chunk:
+            yield chunk
+        if decompressor.eof:
+            # Concatenated streams, as lzma.decompress and bz2.decompress accept
+            data = decompressor.unused_data
+            if not data:
+                return
+            decompressor = factory(output_size)
+        elif decompressor.needs_input:
+            raise ValueError("Compressed data ended before the end-of-stream marker")
+
+
+def decompress(data: bytes, op_type: int, output_size: int = -1) -> bytes:
+    """Decompress data based on operation type.
+
+    LZ4 blocks don't record their decoded length, so OP_LZ4 needs output_size.
+    """
     if op_type == OP_REPLACE:
         return data
-    if op_type == OP_REPLACE_XZ:
-        return lzma.decompress(data)
-    if op_type == OP_REPLACE_BZ:
-        return bz2.decompress(data)
-    raise ValueError(f"Unsupported: {OP_NAMES.get(op_type, op_type)}")
+    if op_type == OP_LZ4 and output_size < 0:
+        raise ValueError("LZ4 needs the output size of the operation")
+    return b''.join(iter_decompressed(data, op_type, output_size=output_size))
 
 
-def extract_partition(payload: Payload, partition: Partition, output_path: Path) -> bool:
-    """Extract a single partition"""
-    total = len(partition.operations)
-    bs = payload.block_size
+def offtin(buf: bytes, pos: int) -> int:
+    """Decode a bsdiff sign-magnitude 64-bit little-endian integer"""
+    value = int.from_bytes(buf[pos:pos + 8], 'little')
+    return -(value & ~(1 << 63)) if value >> 63 else value
 
-    with open(payload.path, 'rb') as f_in, open(output_path, 'wb') as f_out:
-        for i, op in enumerate(partition.operations):
-            print(f"\r  Extracting: {(i + 1) * 100 // total}% ({i + 1}/{total})", end='', flush=True)
 
+def add_bytes(a: bytes, b: bytes) -> bytes:
+    """Bytewise (a + b) mod 256 of two equal-length buffers.
+
+    Spreads both into 16-bit lanes of one big integer, so the addition runs
+    in C and per-byte carries never cross into the next lane.
+    """
+    n = len(a)
+    x = bytearray(2 * n)
+    x[0::2] = a
+    y = bytearray(2 * n)
+    y[0::2] = b
+    total = int.from_bytes(x, 'little') + int.from_bytes(y, 'little')
+    return total.to_bytes(2 * n + 1, 'little')[0:2 * n:2]
+
+
+def load_brotli():
+    """Import the optional brotli package, used by BSDF2 patches from the AOSP delta generator"""
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        raise ValueError("BSDF2 patches with brotli streams need the brotli package") from None
+
+
+# BSDF2 stream compressor id -> decompress function
+BSDIFF_DECOMPRESSORS = {
+    0: bytes,
+    1: bz2.decompress,
+    BSDIFF_BROTLI: lambda data: load_brotli().decompress(bytes(data)),
+}
+
+
+def bsdiff_compressors(patch: bytes) -> tuple[int, int, int]:
+    """Return the compressor ids of a bsdiff patch's control, diff and extra streams"""
+    if patch[:8] == BSDIFF_MAGIC:
+        return 1, 1, 1
+    if patch[:5] == BSDF2_MAGIC and len(patch) >= 8:
+        return tuple(patch[5:8])
+    raise ValueError("Unknown bsdiff patch format")
+
+
+def bsdiff_streams(patch: bytes) -> tuple[bytes, bytes, bytes, int]:
+    """Split a BSDIFF40 or BSDF2 patch into (control, diff, extra, new_size)"""
+    compressors = bsdiff_compressors(patch)
+    ctrl_len, diff_len, new_size = offtin(patch, 8), offtin(patch, 16), offtin(patch, 24)
+    if ctrl_len < 0 or diff_len < 0 or new_size < 0:
+        raise ValueError("Corrupt bsdiff header")
+    bounds = (32, 32 + ctrl_len, 32 + ctrl_len + diff_len, len(patch))
+
+    streams = []
+    for compressor, start, end in zip(compressors, bounds, bounds[1:]):
+        if compressor not in BSDIFF_DECOMPRESSORS:
+            raise ValueError(f"Unsupported bsdiff stream compression: {compressor}")
+        streams.append(BSDIFF_DECOMPRESSORS[compressor](patch[start:end]))
+    return streams[0], streams[1], streams[2], new_size
+
+
+def bspatch(old: bytes, patch: bytes) -> bytes:
+    """Apply a bsdiff patch to old, return the new data"""
+    ctrl, diff, extra, new_size = bsdiff_streams(patch)
+    new = bytearray()
+    old_pos = ctrl_pos = diff_pos = extra_pos = 0
+
+    while len(new) < new_size:
+        if ctrl_pos + 24 > len(ctrl):
+            raise ValueError("Corrupt bsdiff patch: control stream too short")
+        add_len, copy_len, seek = offtin(ctrl, ctrl_pos), offtin(ctrl, ctrl_pos + 8), offtin(ctrl, ctrl_pos + 16)
+        ctrl_pos += 24
+        if add_len < 0 or copy_len < 0 or len(new) + add_len + copy_len > new_size:
+            raise ValueError("Corrupt bsdiff patch: bad control tuple")
+
+        # Diff bytes are added to old bytes; positions outside old pass through
+        delta = diff[diff_pos:diff_pos + add_len]
+        diff_pos += add_len
+        lo, hi = max(old_pos, 0), min(old_pos + add_len, len(old))
+        if lo < hi:
+            new += delta[:lo - old_pos]
+            new += add_bytes(delta[lo - old_pos:hi - old_pos], old[lo:hi])
+            new += delta[hi - old_pos:]
+        else:
+            new += delta
+        old_pos += add_len
+
+        new += extra[extra_pos:extra_pos + copy_len]
+        extra_pos += copy_len
+        old_pos += seek
+
+    if len(new) != new_size:
+        raise ValueError("Corrupt bsdiff patch: truncated diff or extra stream")
+    return bytes(new)
+
+
+class FileReader:
+    """Payload data source that reads through a regular file object"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def fault_in(self, offset: int, length: int):
+        """Make sure the bytes are in memory; read() already copied them"""
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MmapReader(FileReader):
+    """Payload data source that hands out zero-copy memoryview slices of an mmap"""
+
+    def __init__(self, f):
+        super().__init__(f)
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def read(self, offset: int, length: int) -> memoryview:
+        return self.view[offset:offset + length]
+
+    def fault_in(self, offset: int, length: int):
+        """Page the range in now rather than on first access, so profiling charges the disk I/O to it"""
+        if length <= 0:
+            return
+        start = offset - offset % mmap.PAGESIZE
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self.map.madvise(mmap.MADV_WILLNEED, start, offset + length - start)
+        bytes(self.view[start:offset + length:mmap.PAGESIZE])  # touch one byte per page
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            pass  # slices still referenced; the mapping goes away with the last one
+        super().close()
+
+
+class HttpFile(io.RawIOBase):
+    """Seekable read-only remote file backed by HTTP range requests.
+
+    A response stays open while reads are sequential, so a sorted op schedule
+    streams each contiguous run of blobs over a single request. A dropped
+    connection is reopened at the first missing byte, HTTP_RETRIES times per
+    read.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.url = url
+        self.pos = 0
+        self.response = None
+        self.response_pos = 0
+        self.fetched = 0
+        with self._request(0, 0) as response:
+            content_range = response.headers.get('Content-Range', '')  # bytes 0-0/<size>
+        self.size = int(content_range.rpartition('/')[2])
+
+    def _request(self, start: int, end: int | None = None):
+        req = Request(self.url)
+        req.add_header('User-Agent', HTTP_USER_AGENT)
+        req.add_header('Range', f"bytes={start}-{'' if end is None else end}")
+        response = urlopen(req, timeout=HTTP_TIMEOUT)
+        if response.status != 206:
+            response.close()
+            raise ValueError(f"Server does not support range requests: {self.url}")
+        return response
+
+    def _close_response(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b) -> int:
+        length = min(len(b), self.size - self.pos)
+        if length <= 0:
+            return 0
+
+        gap = self.pos - self.response_pos
+        if self.response is not None and not 0 <= gap <= HTTP_SKIP_LIMIT:
+            self._close_response()
+        elif self.response is not None and gap:
+            try:
+                skipped = len(self.response.read(gap))
+            except (OSError, HTTPException):
+                skipped = 0
+            self.fetched += skipped
+            if skipped != gap:
+                self._close_response()
+            self.response_pos = self.pos
+
+        view = memoryview(b)[:length]
+        got = 0
+        failures = 0
+        while got < length:
+            try:
+                if self.response is None:
+                    self.response = self._request(self.pos + got)
+                n = self.response.readinto(view[got:])
+                if not n:
+                    raise IOError(f"Connection closed at offset {self.pos + got}")
+            except (OSError, HTTPException):
+                self._close_response()
+                failures += 1
+                if failures > HTTP_RETRIES:
+                    raise
+                time.sleep(HTTP_RETRY_DELAY * 2 ** (failures - 1))
+                continue
+            got += n
+
+        self.pos += got
+        self.response_pos = self.pos
+        self.fetched += got
+        return got
+
+    def close(self):
+        self._close_response()
+        super().close()
+
+
+def is_url(source) -> bool:
+    """Check whether a payload source is an http(s) URL"""
+    return isinstance(source, str) and source.startswith(('http://', 'https://'))
+
+
+def open_source(source: Path | str):
+    """Open a local path or an http(s) URL as a binary file object"""
+    if is_url(source):
+        return HttpFile(source)
+    return open(source, 'rb')
+
+
+def open_reader(path: Path | str) -> FileReader:
+    """Open a payload data source, memory-mapped when the file supports it"""
+    f = open_source(path)
+    if isinstance(f, HttpFile):
+        return FileReader(f)
+    try:
+        return MmapReader(f)
+    except (ValueError, OSError):
+        return FileReader(f)
+
+
+def read_operation(reader: FileReader, payload: Payload, op: Operation) -> bytes:
+    """Read the raw data blob of an operation"""
+    return reader.read(payload.data_offset + op.data_offset, op.data_length)
+
+
+def op_location(index: int, partition: str | None = None) -> str:
+    """Name an operation in error messages, with its partition when known"""
+    return f"operation {index} of {partition}" if partition else f"operation {index}"
+
+
+def verify_operation(index: int, op: Operation, compressed: bytes, partition: str | None = None):
+    """Check operation data against its SHA-256"""
+    if op.data_sha256 and hashlib.sha256(compressed).digest() != op.data_sha256:
+        raise ValueError(f"Hash mismatch at {op_location(index, partition)}")
+
+
+def iter_nonzero_runs(data: bytes, bs: int, start: int = 0, end: int | None = None):
+    """Yield (offset, length) of runs of blocks in data[start:end] that are not all zero.
+
+    Offsets are relative to start. bytes and bytearray are compared in place
+    with startswith; other buffers (mmap views) are scanned through bounded
+    copies, which may split a run in two at a window edge.
+    """
+    end = len(data) if end is None else end
+    if not isinstance(data, (bytes, bytearray)):
+        view = memoryview(data)
+        step = max(bs, DECODE_CHUNK_SIZE // bs * bs)
+        for base in range(start, end, step):
+            window = view[base:min(base + step, end)].tobytes()
+            for offset, length in iter_nonzero_runs(window, bs):
+                yield base - start + offset, length
+        return
+
+    zero_block = bytes(bs)
+    run_start = None
+    for pos in range(start, end, bs):
+        if data.startswith(zero_block if pos + bs <= end else zero_block[:end - pos], pos):
+            if run_start is not None:
+                yield run_start - start, pos - run_start
+                run_start = None
+        elif run_start is None:
+            run_start = pos
+    if run_start is not None:
+        yield run_start - start, end - run_start
+
+
+def pwrite_buffers(fd: int, buffers: list, offset: int):
+    """Write buffers back to back starting at offset, batched with pwritev"""
+    if len(buffers) == 1 or not hasattr(os, 'pwritev'):
+        for view in buffers:
+            while view:
+                written = os.pwrite(fd, view, offset)
+                offset += written
+                view = view[written:]
+        return
+
+    while buffers:
+        batch = buffers[:WRITE_IOV_MAX]
+        written = os.pwritev(fd, batch, offset)
+        offset += written
+        # Drop fully written buffers and trim a partially written one
+        done = 0
+        while done < len(batch) and written >= len(batch[done]):
+            written -= len(batch[done])
+            done += 1
+        buffers = buffers[done:]
+        if written:
+            buffers[0] = buffers[0][written:]
+
+
+class ExtentWriter:
+    """Write a stream of decoded chunks across an op's destination extents.
+
+    Chunks are sliced with memoryviews (no copies) and written with
+    positional writes only, so writers for different ops can run in parallel
+    on the same file. Pieces that land back to back on disk are issued as a
+    single pwritev. In sparse mode all-zero blocks are skipped and left as
+    holes in the (pre-truncated) output file.
+    """
+
+    def __init__(self, fd: int, extents: list, bs: int, sparse: bool = False, write=None):
+        self.fd = fd
+        self.bs = bs
+        self.sparse = sparse
+        self.sink = write or pwrite_buffers  # (fd, buffers, offset); may queue the buffers
+        self.extents = iter(extents)
+        self.offset = 0  # file offset of the next byte in the current extent
+        self.remaining = 0  # bytes left in the current extent
+
+    def write(self, *chunks):
+        """Write chunks in order, as contiguous batches handed to the sink"""
+        batch, batch_offset, batch_end = [], 0, 0
+        for chunk in chunks:
+            view = memoryview(chunk)
+            pos = 0
+            while pos < len(view):
+                if not self.remaining:
+                    start, num = next(self.extents, (None, None))
+                    if start is None:
+                        raise ValueError("Decoded data exceeds destination extents")
+                    self.offset = start * self.bs
+                    self.remaining = num * self.bs
+
+                size = min(self.remaining, len(view) - pos)
+                if self.sparse:
+                    runs = iter_nonzero_runs(chunk, self.bs, pos, pos + size)
+                else:
+                    runs = ((0, size),)
+                for offset, length in runs:
+                    target = self.offset + offset
+                    if batch and target != batch_end:
+                        self.sink(self.fd, batch, batch_offset)
+                        batch = []
+                    if not batch:
+                        batch_offset = target
+                    batch.append(view[pos + offset:pos + offset + length])
+                    batch_end = target + length
+
+                self.offset += size
+                self.remaining -= size
+                pos += size
+        if batch:
+            self.sink(self.fd, batch, batch_offset)
+
+
+def write_zeros(fd: int, extents: list, bs: int):
+    """Explicitly write zeros over extents in bounded-size chunks"""
+    zeros = bytes(DECODE_CHUNK_SIZE)
+    for start, num in extents:
+        offset, end = start * bs, (start + num) * bs
+        while offset < end:
+            offset += os.pwrite(fd, zeros[:end - offset], offset)
+
+
+def read_source_extents(index: int, op: Operation, source: memoryview | None, bs: int,
+                        verify: bool = True, partition: str | None = None) -> list:
+    """Return zero-copy views of an incremental op's source extents, verified"""
+    where = op_location(index, partition)
+    if source is None:
+        raise ValueError(f"{OP_NAMES[op.op_type]} at {where} needs a source image (--source-dir)")
+
+    views = [source[start * bs:(start + num) * bs] for start, num in op.src_extents]
+    if any(len(view) != num * bs for view, (_, num) in zip(views, op.src_extents)):
+        raise ValueError(f"Source image too small for {where}")
+
+    if verify and op.src_sha256:
+        digest = hashlib.sha256()
+        for view in views:
+            digest.update(view)
+        if digest.digest() != op.src_sha256:
+            raise ValueError(f"Source hash mismatch at {where}")
+    return views
+
+
+def apply_operation(fd: int, index: int, op: Operation, compressed: bytes, bs: int, sparse: bool = False,
+                    source: memoryview | None = None, verify_source: bool = True, write=None, tee=None,
+                    partition: str | None = None):
+    """Decompress and write one (already verified) operation.
+
+    Output is produced and written DECODE_CHUNK_SIZE bytes at a time, so peak
+    memory is bounded by the compressed blob plus one chunk, however large
+    the op is. Incremental ops read from the memory-mapped source image.
+    write replaces the positional write of each batch (see ExtentWriter);
+    tee, a binary file, receives a copy of decompressed or patched output.
+    partition only names the op in errors.
+    """
+    writer = ExtentWriter(fd, op.dst_extents, bs, sparse, write)
+
+    if op.op_type == OP_SOURCE_COPY:
+        # Source views are stable, so adjacent extents go out in one pwritev
+        writer.write(*read_source_extents(index, op, source, bs, verify_source, partition))
+        return
+
+    if op.op_type == OP_SOURCE_BSDIFF:
+        old = b''.join(read_source_extents(index, op, source, bs, verify_source, partition))
+        chunks = [bspatch(old, compressed)]
+    else:
+        output_size = sum(num for _, num in op.dst_extents) * bs
+        chunks = iter_decompressed(compressed, op.op_type, output_size=output_size)
+
+    for chunk in chunks:
+        if tee is not None:
+            tee.write(chunk)
+        writer.write(chunk)
+
+
+def decode_operation(index: int, op: Operation, compressed: bytes, bs: int,
+                     source: memoryview | None = None, verify_source: bool = True,
+                     partition: str | None = None) -> bytes:
+    """Return an op's whole output: its dst extents back to back, in memory"""
+    output_size = sum(num for _, num in op.dst_extents) * bs
+    if op.op_type == OP_ZERO:
+        return bytes(output_size)
+    if op.op_type in INCREMENTAL_OPS:
+        old = b''.join(read_source_extents(index, op, source, bs, verify_source, partition))
+        if op.op_type == OP_SOURCE_COPY:
+            return old
+        return bspatch(old, compressed)
+    return b''.join(iter_decompressed(compressed, op.op_type, output_size=output_size))
+
+
+def copy_extents(op: Operation, index: int, bs: int,
+                 partition: str | None = None) -> list[tuple[int, int, int, int]]:
+    """Map a SOURCE_COPY op's dst extents onto its src extents.
+
+    Returns (file offset, length, index, source offset) pieces, one per
+    stretch where a dst extent and a src extent overlap.
+    """
+    pieces = []
+    src = iter(op.src_extents)
+    src_start = src_left = 0
+    for start, num in op.dst_extents:
+        while num:
+            if not src_left:
+                try:
+                    src_start, src_left = next(src)
+                except StopIteration:
+                    where = op_location(index, partition)
+                    raise ValueError(f"Source extents shorter than destination at {where}") from None
+            n = min(num, src_left)
+            pieces.append((start * bs, n * bs, index, src_start * bs))
+            start, num = start + n, num - n
+            src_start, src_left = src_start + n, src_left - n
+    return pieces
+
+
+class PartitionFile(io.RawIOBase):
+    """Seekable read-only view of a partition image, decoded from the payload on demand.
+
+    Only the ops covering the bytes read are fetched and decoded; the last
+    OPEN_PARTITION_CACHE decoded ops are kept, so reading a header and a
+    footer touches two ops. ZERO ops and blocks no op writes read as holes,
+    and SOURCE_COPY extents are read straight from the source image.
+    """
+
+    def __init__(self, payload: Payload, partition: Partition, source: Path | None = None,
+                 verify: bool = True):
+        super().__init__()
+        self.payload = payload
+        self.partition = partition
+        self.verify = verify
+        self.pos = 0
+        self.cache = OrderedDict()  # op index -> decoded output
+        self.copied = set()  # SOURCE_COPY ops whose source extents have been checked
+
+        # (file offset, length, op index, offset in op output or in the source image),
+        # sorted by file offset
+        bs = payload.block_size
+        extents = []
+        for i, op in enumerate(partition.operations):
             if op.op_type == OP_ZERO:
-                for start, num in op.dst_extents:
-                    f_out.seek(start * bs)
-                    f_out.write(bytes(num * bs))
                 continue
+            if op.op_type == OP_SOURCE_COPY:
+                extents += copy_extents(op, i, bs, partition.name)
+                continue
+            out = 0
+            for start, num in op.dst_extents:
+                extents.append((start * bs, num * bs, i, out))
+                out += num * bs
+        extents.sort()
+        self.extents = extents
+        self.starts = [extent[0] for extent in extents]
+        end = max((start + num for op in partition.operations for start, num in op.dst_extents), default=0)
+        self.size = max(partition.size, end * bs)
 
-            if op.op_type in (OP_SOURCE_COPY, OP_SOURCE_BSDIFF, OP_PUFFDIFF):
-                raise ValueError(f"Incremental op not supported: {OP_NAMES.get(op.op_type)}")
+        self.reader = open_reader(payload.path)
+        self.source = MmapReader(open(source, 'rb')) if source else None
 
-            f_in.seek(payload.data_offset + op.data_offset)
-            compressed = f_in.read(op.data_length)
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.pos = offset
+        return self.pos
+
+    def _decoded(self, index: int) -> bytes:
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        op = self.partition.operations[index]
+        compressed = b''
+        if op.op_type != OP_ZERO:
+            compressed = read_operation(self.reader, self.payload, op)
+            if self.verify:
+                verify_operation(index, op, compressed, self.partition.name)
+        source = self.source.view if self.source else None
+        data = decode_operation(index, op, compressed, self.payload.block_size, source, self.verify,
+                                self.partition.name)
+        self.cache[index] = data
+        if len(self.cache) > OPEN_PARTITION_CACHE:
+            self.cache.popitem(last=False)
+        return data
+
+    def _copied(self, index: int) -> memoryview:
+        """The source image, once index's source extents have been checked"""
+        source = self.source.view if self.source else None
+        if index not in self.copied:
+            read_source_extents(index, self.partition.operations[index], source, self.payload.block_size,
+                                self.verify, self.partition.name)
+            self.copied.add(index)
+        return source
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast('B')
+        length = min(len(view), self.size - self.pos)
+        if length <= 0:
+            return 0
+
+        got = 0
+        while got < length:
+            pos = self.pos + got
+            i = bisect_right(self.starts, pos) - 1
+            if i >= 0 and pos < self.extents[i][0] + self.extents[i][1]:
+                start, size, index, out = self.extents[i]
+                if self.partition.operations[index].op_type == OP_SOURCE_COPY:
+                    data = self._copied(index)
+                else:
+                    data = self._decoded(index)
+                lo = out + pos - start
+                n = min(length - got, start + size - pos)
+                piece = data[lo:lo + n]
+                view[got:got + len(piece)] = piece
+                view[got + len(piece):got + n] = bytes(n - len(piece))  # short REPLACE data
+            else:
+                # Hole up to the next extent
+                following = self.starts[i + 1] if i + 1 < len(self.starts) else self.size
+                n = min(length - got, following - pos)
+                view[got:got + n] = bytes(n)
+            got += n
+
+        self.pos += got
+        return got
+
+    def close(self):
+        if not self.closed:
+            self.cache.clear()
+            self.reader.close()
+            if self.source:
+                self.source.close()
+        super().close()
+
+
+def schedule_operations(partitions: list[Partition]) -> list[tuple[int, int, Operation]]:
+    """Merge the data-carrying ops of several partitions into payload order.
+
+    Returns (partition_index, op_index, op) sorted by data_offset, so the data
+    blob is read front to back in one sequential pass.
+    """
+    tasks = [(p, i, op)
+             for p, part in enumerate(partitions)
+             for i, op in enumerate(part.operations)
+             if op.op_type != OP_ZERO]
+    tasks.sort(key=lambda task: task[2].data_offset)
+    return tasks
+
+
+def file_sha256(path: Path) -> bytes:
+    """Stream a file through SHA-256"""
+    digest = hashlib.sha256()
+    buf = bytearray(DECODE_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while n := f.readinto(buf):
+            digest.update(view[:n])
+    return digest.digest()
+
+
+class BlobCache:
+    """Content-addressed on-disk cache of decoded op output.
+
+    Entries are keyed by the op type and data_sha256 (plus src_sha256 for
+    patches), so blobs that consecutive firmware versions share are decoded
+    once. A hit skips reading the blob as well, so entries are only written
+    for ops whose data and source hashes were checked. Least recently used
+    entries are evicted once the total exceeds max_bytes. Hits are counted
+    per partition.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = BLOB_CACHE_SIZE * 1024 * 1024):
+        self.dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.stats = {}  # partition index -> [hits, lookups]
+
+    @staticmethod
+    def key(op: Operation) -> str | None:
+        if op.op_type not in BLOB_CACHE_OPS or not op.data_sha256:
+            return None
+        if op.op_type in INCREMENTAL_OPS:
+            if not op.src_sha256:
+                return None
+            return f"{op.op_type}-{op.data_sha256.hex()}-{op.src_sha256.hex()}"
+        return f"{op.op_type}-{op.data_sha256.hex()}"
+
+    def open(self, op: Operation, part: int = 0):
+        """Return the cached output of op as an open file, or None on a miss"""
+        key = self.key(op)
+        if key is None:
+            return None
+        stats = self.stats.setdefault(part, [0, 0])
+        stats[1] += 1
+        path = self.dir / f"{key}.blob"
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used for eviction
+        except OSError:
+            pass  # read-only or shared cache: still a hit
+        stats[0] += 1
+        return f
+
+    @contextmanager
+    def writer(self, op: Operation):
+        """Yield a file for op's decoded output, committed if the block succeeds"""
+        key = self.key(op)
+        tmp = self.dir / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            f = open(tmp, 'wb')
+        except OSError:
+            yield None  # cache not writable; extract without it
+            return
+        try:
+            with f:
+                yield f
+            os.replace(tmp, self.dir / f"{key}.blob")
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def evict(self):
+        evict_cache(self.dir, self.max_bytes, '*.blob')
+
+
+def copy_cached(fd: int, op: Operation, cached, bs: int, sparse: bool = False, write=None):
+    """Write an op's output from a blob cache file"""
+    writer = ExtentWriter(fd, op.dst_extents, bs, sparse, write)
+    with cached:
+        while chunk := cached.read(DECODE_CHUNK_SIZE):
+            writer.write(chunk)
+
+
+@dataclass
+class StageEvent:
+    """Timing of one pipeline stage for one op, passed to ExtractOptions.hooks"""
+    stage: str  # read, hash, decode.<OP_TYPE>, cache or write; read includes paging in mmapped blobs
+    partition: str
+    op_index: int
+    start: float  # time.perf_counter() when the stage began
+    duration: float  # seconds, excluding time blocked on other stages
+    nbytes: int  # blob bytes for read/hash, output bytes otherwise
+    thread: str = ''
+
+
+class Profiler:
+    """Extraction hook accumulating time and bytes per partition and stage.
+
+    Hooks run on pipeline threads, so updates are locked. With trace=True
+    every event is also kept for a Chrome trace-event export
+    (chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    STAGE_ORDER = ('read', 'hash', 'cache', 'decode', 'write')
+
+    def __init__(self, trace: bool = False):
+        self.totals = {}  # (partition, stage) -> [seconds, bytes, ops]
+        self.events = [] if trace else None
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, event: StageEvent):
+        with self.lock:
+            total = self.totals.setdefault((event.partition, event.stage), [0.0, 0, 0])
+            total[0] += event.duration
+            total[1] += event.nbytes
+            total[2] += 1
+            if self.events is not None:
+                self.events.append(event)
+
+    def summary(self) -> str:
+        lines = [f"{'Partition':<20} {'Stage':<20} {'Time':>9} {'Bytes':>12} {'Rate':>12} {'Ops':>6}",
+                 "-" * 84]
+        def order(item):
+            (partition, stage), _ = item
+            return partition, self.STAGE_ORDER.index(stage.partition('.')[0]), stage
+
+        stages = {}
+        for (partition, stage), values in self.totals.items():
+            total = stages.setdefault(('total', stage), [0.0, 0, 0])
+            for k, value in enumerate(values):
+                total[k] += value
+        rows = sorted(self.totals.items(), key=order) + sorted(stages.items(), key=order)
+        for (partition, stage), (seconds, nbytes, ops) in rows:
+            rate = f"{nbytes / seconds / 1024**2:.1f} MB/s" if seconds else '-'
+            lines.append(f"{partition:<20} {stage:<20} {seconds:>8.3f}s {format_size(nbytes):>12} "
+                         f"{rate:>12} {ops:>6}")
+        return '\n'.join(lines)
+
+    def write_trace(self, path: Path):
+        """Export the recorded events in Chrome trace-event format"""
+        tids = {}
+        events = []
+        for event in self.events or []:
+            tid = tids.setdefault(event.thread, len(tids))
+            events.append({
+                'name': event.stage, 'cat': event.partition, 'ph': 'X', 'pid': 0, 'tid': tid,
+                'ts': round((event.start - self.origin) * 1e6, 1),
+                'dur': round(event.duration * 1e6, 1),
+                'args': {'op': event.op_index, 'bytes': event.nbytes},
+            })
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': name}}
+                   for name, tid in tids.items()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+class PipelineCancelled(Exception):
+    """Raised in a pipeline stage once another stage has failed"""
 
-            if op.data_sha256 and hashlib.sha256(compressed).digest() != op.data_sha256:
-                print(f"\n  Error: Hash mismatch at operation {i}")
-                return False
 
+class Pipeline:
+    """Three-stage extraction: reader thread -> decode threads -> writer thread.
+
+    The reader fetches op blobs in data_offset order and checks their hashes,
+    `jobs` decode threads turn them into positional write batches and a
+    single writer issues those. lzma, bz2, hashlib and file I/O release the
+    GIL, so the stages overlap. The queues between them hold PIPELINE_DEPTH
+    items per decode thread, which caps memory. Busy time is recorded per
+    stage to tell I/O-bound runs from CPU-bound ones.
+    """
+
+    STAGES = ('read', 'decode', 'write')
+
+    def __init__(self, reader: FileReader, payload: Payload, fds: list[int],
+                 sources: list | None = None, options: ExtractOptions | None = None,
+                 names: list[str] | None = None):
+        self.reader = reader
+        self.payload = payload
+        self.fds = fds
+        self.sources = sources or [None] * len(fds)
+        self.names = names or [str(p) for p in range(len(fds))]
+        self.options = options or ExtractOptions()
+        self.hooks = self.options.hooks
+        self.jobs = max(1, self.options.jobs)
+        self.cache = None
+        if self.options.blob_cache is not None:
+            self.cache = BlobCache(self.options.blob_cache, self.options.blob_cache_size * 1024 * 1024)
+        self.blobs = queue.Queue(self.jobs * PIPELINE_DEPTH)
+        self.writes = queue.Queue(self.jobs * PIPELINE_DEPTH)
+        self.done = queue.Queue()
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.threads = {'read': 1, 'decode': self.jobs, 'write': 1}
+        self.busy = dict.fromkeys(self.STAGES, 0.0)
+        self.wall = 0.0
+
+    def put(self, q: queue.Queue, item) -> float:
+        """Blocking put that gives up when the pipeline stops; returns seconds waited"""
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=PIPELINE_POLL)
+                return time.perf_counter() - start
+            except queue.Full:
+                pass
+        raise PipelineCancelled
+
+    def get(self, q: queue.Queue):
+        """Blocking get that gives up when the pipeline stops"""
+        while not self.stop.is_set():
             try:
-                data = decompress(compressed, op.op_type)
-            except Exception as e:
-                print(f"\n  Error: {e}")
+                return q.get(timeout=PIPELINE_POLL)
+            except queue.Empty:
+                pass
+        raise PipelineCancelled
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            self.busy[stage] += seconds
+
+    def emit(self, stage: str, task: tuple, start: float, duration: float, nbytes: int):
+        """Pass one stage timing to the hooks"""
+        event = StageEvent(stage, self.names[task[0]], task[1], start, duration, nbytes,
+                           threading.current_thread().name)
+        for hook in self.hooks:
+            hook(event)
+
+    def guard(self, body, *args):
+        """Thread target: run a stage, keep the first error and stop the others"""
+        try:
+            body(*args)
+        except PipelineCancelled:
+            pass
+        except Exception as e:
+            with self.lock:
+                self.error = self.error or e
+            self.stop.set()
+
+    def read_stage(self, tasks: list):
+        busy = 0.0
+        check = self.options.verify != 'none'
+        try:
+            for task in tasks:
+                p, i, op = task
+                start = time.perf_counter()
+                compressed = None
+                cached = self.cache.open(op, p) if self.cache else None
+                if cached is None:
+                    compressed = read_operation(self.reader, self.payload, op)
+                    if self.hooks:
+                        # A mmap slice is lazy: without this its page faults land in hash or decode
+                        self.reader.fault_in(self.payload.data_offset + op.data_offset, op.data_length)
+                    read = time.perf_counter()
+                    if check:
+                        verify_operation(i, op, compressed, self.names[p])
+                    if self.hooks:
+                        self.emit('read', task, start, read - start, op.data_length)
+                        if check:
+                            self.emit('hash', task, read, time.perf_counter() - read, op.data_length)
+                busy += time.perf_counter() - start
+                self.put(self.blobs, (task, compressed, cached))
+            for _ in range(self.jobs):
+                self.put(self.blobs, None)
+        finally:
+            self.record('read', busy)
+
+    def decode_stage(self):
+        busy = waited = 0.0
+        bs = self.payload.block_size
+        check = self.options.verify != 'none'
+        batches, size = [], 0
+
+        def flush(done=False):
+            # One queue item per op, or per DECODE_CHUNK_SIZE of output for large ops
+            nonlocal batches, size, waited
+            waited += self.put(self.writes, (batches, task, done))
+            batches, size = [], 0
+
+        def write(fd, buffers, offset):
+            nonlocal size
+            batches.append((fd, buffers, offset))
+            size += sum(len(buf) for buf in buffers)
+            if size >= DECODE_CHUNK_SIZE:
+                flush()
+
+        try:
+            while (item := self.get(self.blobs)) is not None:
+                task, compressed, cached = item
+                p, i, op = task
+                start, waited_before = time.perf_counter(), waited
+                if cached is not None:
+                    copy_cached(self.fds[p], op, cached, bs, self.options.sparse, write)
+                else:
+                    with ExitStack() as stack:
+                        tee = None
+                        # Only hash-checked blobs may fill the cache: later runs trust its entries
+                        if check and self.cache and self.cache.key(op):
+                            tee = stack.enter_context(self.cache.writer(op))
+                        apply_operation(self.fds[p], i, op, compressed, bs, self.options.sparse,
+                                        self.sources[p], check, write, tee, self.names[p])
+                elapsed = time.perf_counter() - start
+                busy += elapsed
+                if self.hooks:
+                    stage = 'cache' if cached is not None else f"decode.{OP_NAMES.get(op.op_type, op.op_type)}"
+                    output = sum(num for _, num in op.dst_extents) * bs
+                    self.emit(stage, task, start, elapsed - (waited - waited_before), output)
+                flush(True)  # the writer reports the task after its last batch
+        finally:
+            self.record('decode', busy - waited)
+
+    def write_stage(self):
+        busy = 0.0
+        try:
+            while (item := self.get(self.writes)) is not None:
+                batches, task, done = item
+                start = time.perf_counter()
+                for fd, buffers, offset in batches:
+                    pwrite_buffers(fd, buffers, offset)
+                elapsed = time.perf_counter() - start
+                busy += elapsed
+                if self.hooks and batches:
+                    nbytes = sum(len(buf) for _, buffers, _ in batches for buf in buffers)
+                    self.emit('write', task, start, elapsed, nbytes)
+                if done:
+                    self.done.put(task)
+        finally:
+            self.record('write', busy)
+
+    def run(self, tasks: list):
+        """Yield each task once all of its data has been written.
+
+        Tasks complete out of order when jobs > 1; dst_extents make every
+        write position-independent. A stage error is re-raised here.
+        """
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self.guard, args=(self.read_stage, tasks), name='read', daemon=True)]
+        threads += [threading.Thread(target=self.guard, args=(self.decode_stage,), name=f"decode-{n}", daemon=True)
+                    for n in range(1, self.jobs + 1)]
+        threads.append(threading.Thread(target=self.guard, args=(self.write_stage,), name='write', daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(len(tasks)):
+                yield self.get(self.done)
+            self.put(self.writes, None)
+        except PipelineCancelled:
+            raise self.error
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall = time.perf_counter() - start
+
+    def utilization(self) -> dict:
+        """Fraction of wall time each stage's threads spent working"""
+        wall = self.wall or 1e-9
+        return {stage: self.busy[stage] / (wall * self.threads[stage]) for stage in self.STAGES}
+
+    def summary(self) -> str:
+        usage = self.utilization()
+        stages = ', '.join(f"{stage} {usage[stage]:.0%}" + (f" x{self.threads[stage]}" if self.threads[stage] > 1 else '')
+                           for stage in self.STAGES)
+        bound = 'CPU' if max(usage, key=usage.get) == 'decode' else 'I/O'
+        return f"Stages: {stages} ({bound}-bound)"
+
+
+def status_stream(progress: str):
+    """Where human-readable messages go: stderr when stdout carries JSON events"""
+    return sys.stderr if progress == 'json' else sys.stdout
+
+
+class Progress:
+    """Time-throttled extraction progress with input/output throughput.
+
+    bar redraws a single carriage-return line, log prints a plain line every few seconds
+    for CI logs, json writes one JSON object per line to stdout and none is
+    silent. auto picks bar on a TTY and log otherwise.
+    """
+
+    def __init__(self, mode: str = 'auto', total_ops: int = 0, total_bytes: int = 0,
+                 interval: float | None = None):
+        if mode == 'auto':
+            mode = 'bar' if IS_INTERACTIVE else 'log'
+        self.mode = mode
+        self.interval = PROGRESS_INTERVAL.get(mode, 0.0) if interval is None else interval
+        self.out = status_stream(mode)
+        self.total_ops = total_ops
+        self.total_bytes = total_bytes
+        self.ops = self.bytes_in = self.bytes_out = 0
+        self.start = self.last = time.monotonic()
+        self.drawn = False
+        self.event('start', total_ops=total_ops, total_bytes=total_bytes)
+
+    def event(self, kind: str, **fields):
+        """Emit a JSON-lines event (json mode only)"""
+        if self.mode == 'json':
+            print(json.dumps({'event': kind, 'time': round(time.monotonic() - self.start, 3), **fields}),
+                  flush=True)
+
+    def message(self, text: str):
+        """Print a status line, ending the progress bar line first"""
+        if self.drawn:
+            print(file=self.out)
+            self.drawn = False
+        print(text, file=self.out)
+
+    def update(self, ops: int = 1, bytes_in: int = 0, bytes_out: int = 0):
+        """Account for finished ops; reports at most once per interval"""
+        self.ops += ops
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def stats(self, now: float) -> dict:
+        elapsed = max(now - self.start, 1e-9)
+        return {
+            'ops': self.ops, 'total_ops': self.total_ops,
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out, 'total_bytes': self.total_bytes,
+            'rate_in': round(self.bytes_in / elapsed), 'rate_out': round(self.bytes_out / elapsed),
+        }
+
+    def report(self, now: float):
+        if self.mode == 'none':
+            return
+        stats = self.stats(now)
+        if self.mode == 'json':
+            self.event('progress', **stats)
+            return
+        percent = self.ops * 100 // self.total_ops if self.total_ops else 100
+        line = (f"  Extracting: {percent}% ({self.ops}/{self.total_ops}) "
+                f"in {stats['rate_in'] / 1024**2:.1f} MB/s, out {stats['rate_out'] / 1024**2:.1f} MB/s")
+        if self.mode == 'bar':
+            print(f"\r{line}", end='', flush=True, file=self.out)
+            self.drawn = True
+        else:
+            print(line, flush=True, file=self.out)
+
+    def finish(self, ok: bool = True, **fields):
+        """Report the final state regardless of throttling"""
+        now = time.monotonic()
+        if self.mode == 'json':
+            self.event('done' if ok else 'error', **self.stats(now), **fields)
+            return
+        if ok:
+            self.report(now)
+        if self.drawn:
+            print(file=self.out)
+            self.drawn = False
+
+
+def verify_partitions(partitions: list[Partition], output_paths: list[Path], progress: Progress,
+                      jobs: int = 1) -> bool:
+    """Compare each extracted image against its manifest SHA-256"""
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        digests = pool.map(lambda path: file_sha256(path), output_paths)
+        for part, digest in zip(partitions, digests):
+            if not part.hash:
+                progress.message(f"  {part.name}: no partition hash in manifest, not verified")
+                result = 'unverified'
+            elif digest != part.hash:
+                progress.message(f"  Error: {part.name}: partition hash mismatch")
+                progress.event('verify', partition=part.name, result='mismatch')
                 return False
+            else:
+                progress.message(f"  {part.name}: SHA-256 OK")
+                result = 'ok'
+            progress.event('verify', partition=part.name, result=result)
+    return True
 
-            pos = 0
-            for start, num in op.dst_extents:
-                size = num * bs
-                f_out.seek(start * bs)
-                f_out.write(data[pos:pos + size])
-                pos += size
 
-    print()
+def check_operations(partitions: list[Partition]):
+    """Raise ValueError if any op type has no decoder with its backend installed.
+
+    Only the manifest is looked at; brotli streams inside BSDF2 patches are
+    found when the patch is applied.
+    """
+    checked = {OP_REPLACE, OP_ZERO, OP_SOURCE_COPY, OP_SOURCE_BSDIFF}
+    for part in partitions:
+        for i, op in enumerate(part.operations):
+            if op.op_type in checked:
+                continue
+            try:
+                if op.op_type not in CODECS:
+                    raise ValueError(f"Unsupported: {OP_NAMES.get(op.op_type, op.op_type)}")
+                CODECS[op.op_type](0)  # imports the backend
+            except ValueError as e:
+                raise ValueError(f"{e} ({op_location(i, part.name)})") from None
+            checked.add(op.op_type)
+
+
+def extract_partitions(payload: Payload, partitions: list[Partition], output_paths: list[Path],
+                       options: ExtractOptions | None = None) -> bool:
+    """Extract several partitions in a single sequential pass over the payload.
+
+    Outputs are sized to the partition size up front. In sparse mode ZERO ops,
+    all-zero REPLACE blocks and blocks no op touches stay holes on disk.
+    Incremental payloads are applied on top of <source_dir>/<name>.img.
+    Each image is written to <path>.tmp and renamed over path once the whole
+    run has succeeded, so a failed run leaves existing outputs untouched.
+    """
+    options = options or ExtractOptions()
+    out = status_stream(options.progress)
+
+    source_paths = []
+    for part, path in zip(partitions, output_paths):
+        if not any(op.op_type in INCREMENTAL_OPS for op in part.operations):
+            source_paths.append(None)
+            continue
+        if options.source_dir is None:
+            print(f"  Error: '{part.name}' is incremental, pass the previous images with --source-dir", file=out)
+            return False
+        src = Path(options.source_dir) / f"{part.name}.img"
+        if not src.is_file():
+            print(f"  Error: Source image not found: {src}", file=out)
+            return False
+        if src.resolve() == Path(path).resolve():
+            print(f"  Error: Output would overwrite source image {src}", file=out)
+            return False
+        source_paths.append(src)
+
+    progress = Progress(options.progress, sum(part.num_operations for part in partitions),
+                        sum(part.size for part in partitions))
+
+    try:
+        check_operations(partitions)
+    except ValueError as e:
+        progress.finish(False, message=str(e))
+        progress.message(f"  Error: {e}")
+        return False
+
+    tmp_paths = [Path(path).with_name(Path(path).name + '.tmp') for path in output_paths]
+    try:
+        return write_images(payload, partitions, output_paths, tmp_paths, source_paths, options, progress)
+    finally:
+        for tmp in tmp_paths:
+            tmp.unlink(missing_ok=True)
+
+
+def write_images(payload: Payload, partitions: list[Partition], output_paths: list[Path], tmp_paths: list[Path],
+                source_paths: list[Path | None], options: ExtractOptions, progress: Progress) -> bool:
+    """Write the images to tmp_paths in one pass and rename them to output_paths on success"""
+    bs = payload.block_size
+
+    def op_size(op) -> int:
+        return sum(num for _, num in op.dst_extents) * bs
+
+    with ExitStack() as stack:
+        reader = stack.enter_context(open_reader(payload.path))
+        sources = [stack.enter_context(MmapReader(open(src, 'rb'))).view if src else None
+                   for src in source_paths]
+        fds = [stack.enter_context(open(path, 'wb')).fileno() for path in tmp_paths]
+
+        for fd, part in zip(fds, partitions):
+            # Sparse writes skip zero blocks, so size the image even when the manifest has no size
+            end = max((start + num for op in part.operations for start, num in op.dst_extents), default=0)
+            os.ftruncate(fd, max(part.size, end * bs))
+            for op in part.operations:
+                if op.op_type == OP_ZERO:
+                    if not options.sparse:
+                        write_zeros(fd, op.dst_extents, bs)
+                    progress.update(bytes_out=op_size(op))
+
+        pipeline = Pipeline(reader, payload, fds, sources, options, [part.name for part in partitions])
+        try:
+            for _, _, op in pipeline.run(schedule_operations(partitions)):
+                progress.update(bytes_in=op.data_length, bytes_out=op_size(op))
+        except Exception as e:
+            progress.finish(False, message=str(e))
+            progress.message(f"  Error: {e}")
+            return False
+
+        fetched = {}
+        if isinstance(reader.f, HttpFile):
+            fetched = {'fetched': reader.f.fetched, 'remote_size': reader.f.size}
+
+    progress.finish(True, **fetched)
+    progress.message(f"  {pipeline.summary()}")
+    progress.event('stages', **{stage: round(usage, 3) for stage, usage in pipeline.utilization().items()})
+    if pipeline.cache:
+        for p, (hits, lookups) in sorted(pipeline.cache.stats.items()):
+            progress.message(f"  {partitions[p].name}: blob cache {hits}/{lookups} ops reused "
+                             f"({hits * 100 // lookups}%)")
+            progress.event('blob_cache', partition=partitions[p].name, hits=hits, lookups=lookups)
+        try:
+            pipeline.cache.evict()
+        except OSError as e:
+            print(f"Warning: could not trim blob cache: {e}", file=sys.stderr)
+    if fetched:
+        progress.message(f"  Fetched {format_size(fetched['fetched'])} of {format_size(fetched['remote_size'])}")
+    if options.verify == 'full' and not verify_partitions(partitions, tmp_paths, progress, options.jobs):
+        return False
+    for tmp, path in zip(tmp_paths, output_paths):
+        os.replace(tmp, path)
     return True
 
 
+def extract_partition(payload: Payload, partition: Partition, output_path: Path,
+                      options: ExtractOptions | None = None) -> bool:
+    """Extract a single partition"""
+    return extract_partitions(payload, [partition], [output_path], options)
+
+
 def format_size(size: int) -> str:
     """Format byte size for display"""
     for unit in ('B', 'KB', 'MB', 'GB'):
@@ -229,56 +2064,205 @@ def cmd_list(payload: Payload):
     print(f"{'Name':<24} {'Size':>12} {'Ops':>6}")
     print("-" * 44)
     for p in payload.partitions:
-        print(f"{p.name:<24} {format_size(p.size):>12} {len(p.operations):>6}")
+        print(f"{p.name:<24} {format_size(p.size):>12} {p.num_operations:>6}")
 
 
-def cmd_extract(payload: Payload, names: list[str], output_dir: Path) -> bool:
+def cmd_extract(payload: Payload, names: list[str], output_dir: Path,
+                options: ExtractOptions | None = None) -> bool:
     """Extract partitions"""
+    options = options or ExtractOptions()
+    out = status_stream(options.progress)
     by_name = {p.name: p for p in payload.partitions}
 
     for name in names:
         if name not in by_name:
-            print(f"Error: '{name}' not found. Available: {', '.join(sorted(by_name))}")
+            print(f"Error: '{name}' not found. Available: {', '.join(sorted(by_name))}", file=out)
             return False
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    for name in names:
-        part = by_name[name]
-        out = output_dir / f"{name}.img"
-        print(f"\nExtracting '{name}' ({format_size(part.size)}) -> {out}")
+    names = list(dict.fromkeys(names))
+    parts = [by_name[name] for name in names]
+    outputs = [output_dir / f"{name}.img" for name in names]
+    for part, path in zip(parts, outputs):
+        print(f"Extracting '{part.name}' ({format_size(part.size)}) -> {path}", file=out)
 
-        if not extract_partition(payload, part, out):
-            return False
-        print(f"  Done: {format_size(out.stat().st_size)}")
+    if not extract_partitions(payload, parts, outputs, options):
+        return False
 
-    print("\nAll done.")
+    for part, path in zip(parts, outputs):
+        print(f"  Done: {part.name}: {format_size(path.stat().st_size)}", file=out)
+
+    print("\nAll done.", file=out)
     return True
 
 
+def op_key(op: Operation) -> tuple:
+    """Identify what an op writes: its type, data and source hashes and extents"""
+    return (op.op_type, op.data_sha256, op.src_sha256,
+            tuple(map(tuple, op.src_extents)), tuple(map(tuple, op.dst_extents)))
+
+
+def diff_partition(old: Partition | None, new: Partition | None, bs: int = BLOCK_SIZE) -> dict:
+    """Compare one partition between two manifests without reading any op data.
+
+    A partition is unchanged when both manifests carry the same image hash
+    (or, lacking hashes, the same ops). changed_bytes counts the destination
+    blocks of new ops that have no identical counterpart in old.
+    """
+    part = new or old
+    result = {'name': part.name, 'status': 'unchanged', 'old_size': old.size if old else None,
+              'new_size': new.size if new else None, 'ops': 0, 'changed_ops': 0, 'changed_bytes': 0}
+    if new is None:
+        result['status'] = 'removed'
+        return result
+
+    result['ops'] = new.num_operations
+    old_keys = {op_key(op) for op in old.operations} if old else set()
+    for op in new.operations:
+        if op_key(op) not in old_keys:
+            result['changed_ops'] += 1
+            result['changed_bytes'] += sum(num for _, num in op.dst_extents) * bs
+
+    if old is None:
+        result['status'] = 'added'
+    elif old.hash and new.hash:
+        result['status'] = 'unchanged' if old.hash == new.hash else 'changed'
+    elif result['changed_ops'] or old.size != new.size or old.num_operations != new.num_operations:
+        result['status'] = 'changed'
+    return result
+
+
+def diff_payloads(old: Payload, new: Payload) -> list[dict]:
+    """Compare every partition of two payloads (see diff_partition), in new's order"""
+    old_parts = {p.name: p for p in old.partitions}
+    new_parts = {p.name: p for p in new.partitions}
+    names = list(new_parts) + [name for name in old_parts if name not in new_parts]
+    return [diff_partition(old_parts.get(name), new_parts.get(name), new.block_size) for name in names]
+
+
+def cmd_diff(old: Payload, new: Payload, as_json: bool = False):
+    """Print which partitions and ops changed between two payloads"""
+    results = diff_payloads(old, new)
+    if as_json:
+        print(json.dumps({
+            'old': str(old.path),
+            'new': str(new.path),
+            'changed': [r['name'] for r in results if r['status'] != 'unchanged'],
+            'partitions': results,
+        }, indent=2))
+        return
+
+    print(f"Old: {old.path}")
+    print(f"New: {new.path}\n")
+
+    print(f"{'Name':<24} {'Status':<10} {'Changed ops':>12} {'Changed':>12}")
+    print("-" * 61)
+    for r in results:
+        ops = f"{r['changed_ops']}/{r['ops']}" if r['status'] != 'removed' else ''
+        changed = format_size(r['changed_bytes']) if r['status'] != 'removed' else ''
+        print(f"{r['name']:<24} {r['status']:<10} {ops:>12} {changed:>12}")
+
+    changed = sum(r['status'] != 'unchanged' for r in results)
+    print(f"\n{changed} of {len(results)} partitions changed")
+
+
+def main_diff(argv: list[str]):
+    ap = argparse.ArgumentParser(
+        prog=f"{Path(sys.argv[0]).name} diff",
+        description='Compare the manifests of two payloads (op data is never read)')
+    ap.add_argument('old', help='Older payload.bin, OTA zip, or http(s) URL')
+    ap.add_argument('new', help='Newer payload.bin, OTA zip, or http(s) URL')
+    ap.add_argument('--json', action='store_true', help='Output the comparison as JSON')
+    ap.add_argument('--index-cache', type=Path, metavar='DIR',
+                    help='Cache parsed manifests in DIR to speed up repeated runs')
+    args = ap.parse_args(argv)
+
+    payloads = []
+    for arg in (args.old, args.new):
+        source = arg if is_url(arg) else Path(arg)
+        if isinstance(source, Path) and not source.exists():
+            sys.exit(f"Error: {source} not found")
+        payloads.append(source)
+
+    try:
+        old, new = (load_payload(source, compact=True, cache_dir=args.index_cache) for source in payloads)
+        cmd_diff(old, new, args.json)
+    except Exception as e:
+        sys.exit(f"Error: {e}")
+
+
 def main():
+    if sys.argv[1:2] == ['diff']:
+        return main_diff(sys.argv[2:])
+
     ap = argparse.ArgumentParser(
-        description='Extract partitions from Android payload.bin',
+        description='Extract partitions from Android payload.bin or a full OTA zip',
         epilog="Examples:\n"
                "  %(prog)s payload.bin -l\n"
+               "  %(prog)s firmware.zip -p init_boot\n"
+               "  %(prog)s https://example.com/firmware.zip -p init_boot\n"
                "  %(prog)s payload.bin -p boot init_boot\n"
-               "  %(prog)s payload.bin -p boot -o ./out\n",
+               "  %(prog)s payload.bin -p boot -o ./out\n"
+               "  %(prog)s payload.bin -p vendor_dlkm -j 8\n"
+               "  %(prog)s incremental.zip -p boot --source-dir ./old -o ./new\n"
+               "  %(prog)s diff old.zip new.zip\n",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
-    ap.add_argument('payload', type=Path)
+    ap.add_argument('payload', help='payload.bin, OTA zip, or http(s) URL of either')
     ap.add_argument('-l', '--list', action='store_true', help='List partitions')
     ap.add_argument('-p', '--partitions', nargs='+', metavar='NAME', help='Extract partition(s)')
     ap.add_argument('-o', '--output', type=Path, default=Path('.'), help='Output directory')
+    ap.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                    help='Decode operations in N parallel threads (default: 1)')
+    ap.add_argument('--no-sparse', dest='sparse', action='store_false',
+                    help='Write zero blocks explicitly instead of leaving holes')
+    ap.add_argument('--source-dir', type=Path, metavar='DIR',
+                    help='Apply an incremental payload on top of the images in DIR')
+    ap.add_argument('--verify', choices=VERIFY_MODES, default='ops',
+                    help='Hash checks: none, ops (op and source data, default) '
+                         'or full (also the SHA-256 of every extracted image)')
+    ap.add_argument('--progress', choices=PROGRESS_MODES, default='auto',
+                    help='Progress output: bar, periodic log lines, JSON lines on stdout or none '
+                         '(default: bar on a terminal, log otherwise)')
+    ap.add_argument('--profile', action='store_true',
+                    help='Print time and bytes per partition and stage (read, hash, decode, write); '
+                         'read pages each blob in from disk before it is hashed')
+    ap.add_argument('--trace', type=Path, metavar='FILE',
+                    help='Write a Chrome trace-event JSON of every op and stage to FILE (implies --profile)')
+    ap.add_argument('--blob-cache', type=Path, metavar='DIR',
+                    help='Keep decoded op output in DIR and reuse it for identical blobs')
+    ap.add_argument('--blob-cache-size', type=int, default=BLOB_CACHE_SIZE, metavar='MB',
+                    help=f'Maximum blob cache size in MB (default: {BLOB_CACHE_SIZE})')
+    ap.add_argument('--index-cache', type=Path, metavar='DIR',
+                    help='Cache parsed manifests in DIR to speed up repeated runs')
+    ap.add_argument('--index-cache-size', type=int, default=INDEX_CACHE_SIZE, metavar='MB',
+                    help=f'Maximum index cache size in MB (default: {INDEX_CACHE_SIZE})')
     args = ap.parse_args()
 
-    if not args.payload.exists():
-        sys.exit(f"Error: {args.payload} not found")
+    if args.jobs < 1:
+        sys.exit("Error: --jobs must be at least 1")
+
+    source = args.payload if is_url(args.payload) else Path(args.payload)
+    if isinstance(source, Path) and not source.exists():
+        sys.exit(f"Error: {source} not found")
 
     try:
-        payload = load_payload(args.payload)
+        payload = load_payload(source, cache_dir=args.index_cache, cache_size=args.index_cache_size)
 
         if args.partitions:
-            success = cmd_extract(payload, args.partitions, args.output)
+            profiler = Profiler(trace=args.trace is not None) if args.profile or args.trace else None
+            options = ExtractOptions(jobs=args.jobs, sparse=args.sparse,
+                                     source_dir=args.source_dir, verify=args.verify,
+                                     progress=args.progress, blob_cache=args.blob_cache,
+                                     blob_cache_size=args.blob_cache_size,
+                                     hooks=[profiler] if profiler else [])
+            success = cmd_extract(payload, args.partitions, args.output, options)
+            if profiler:
+                print(f"\n{profiler.summary()}", file=status_stream(args.progress))
+                if args.trace:
+                    profiler.write_trace(args.trace)
+                    print(f"Trace written to {args.trace}", file=status_stream(args.progress))
             sys.exit(0 if success else 1)
         else:
             cmd_list(payload)
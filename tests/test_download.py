@@ -0,0 +1,134 @@
+"""
+Multi-connection downloads against the range-capable test server: tail
+stealing, retries, requeueing, journal resume and aborts on a changed file
+Run with: python -m unittest discover tests
+"""
+
+import io
+import json
+import random
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import download_firmware  # noqa: E402
+from download_firmware import SegmentQueue, download_file_multiconnection, journal_path  # noqa: E402
+from test_remote import RangeHandler  # noqa: E402
+
+SIZE = 1024 * 1024
+
+
+class DownloadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = random.Random(1).randbytes(SIZE)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/firmware.zip"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.files = {'/firmware.zip': self.data}
+        self.server.etags = {}
+        self.server.drops = []
+        self.server.delay = 0
+        self.server.log = []
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = Path(self.tmp.name) / 'firmware.zip'
+        for name, value in (('MIN_SPLIT_SIZE', 64 * 1024), ('SEGMENT_READ_SIZE', 16 * 1024),
+                            ('RETRY_DELAY', 0)):
+            patcher = mock.patch.object(download_firmware, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def download(self, connections: int = 1, retries: int = 2, etag=None) -> tuple[bool, str]:
+        out = io.StringIO()
+        with redirect_stdout(out):
+            ok = download_file_multiconnection(self.url, self.output, SIZE, connections, retries, etag)
+        return ok, out.getvalue()
+
+    def assertDownloaded(self):
+        self.assertEqual(self.output.read_bytes(), self.data)
+        self.assertFalse(journal_path(self.output).exists())
+
+    def test_queue_steals_tail(self):
+        segments = SegmentQueue(SIZE, segment_size=SIZE)
+        first = segments.next()
+        segments.claim(first, 1000)
+        second = segments.next()
+        middle = 1000 + (SIZE - 1000) // 2
+        self.assertEqual(segments.steals, 1)
+        self.assertEqual((first.end, second.start, second.end), (middle, middle, SIZE))
+
+    def test_tail_stealing(self):
+        self.server.delay = 0.002
+        ok, out = self.download(connections=3)
+        self.assertTrue(ok)
+        self.assertDownloaded()
+        self.assertIn('slow segment tail', out)
+        self.assertGreater(len({start for start, _ in self.server.log}), 1)
+
+    def test_dropped_connection_resumes_from_written(self):
+        self.server.drops = [50000]
+        ok, _ = self.download()
+        self.assertTrue(ok)
+        self.assertDownloaded()
+        self.assertEqual(self.server.log, [(0, 50000), (50000, None)])
+
+    def test_failed_segment_requeued(self):
+        self.server.delay = 0.001
+        self.server.drops = [50000]
+        ok, out = self.download(connections=2, retries=0)
+        self.assertTrue(ok)
+        self.assertDownloaded()
+        self.assertIn('handed to the others', out)
+        dropped = self.server.log[0][0]
+        self.assertIn((dropped + 50000, None), self.server.log)
+
+    def test_resume_from_journal(self):
+        half = SIZE // 2
+        self.output.write_bytes(self.data[:half] + bytes(SIZE - half))
+        journal_path(self.output).write_text(json.dumps(
+            {'url': self.url, 'size': SIZE, 'etag': None, 'done': [[0, half]]}))
+        ok, out = self.download(connections=2)
+        self.assertTrue(ok)
+        self.assertDownloaded()
+        self.assertIn('Resuming', out)
+        self.assertTrue(self.server.log)
+        self.assertTrue(all(start >= half for start, _ in self.server.log))
+
+    def assertAborted(self, ok: bool):
+        self.assertFalse(ok)
+        self.assertFalse(self.output.exists())
+        self.assertFalse(journal_path(self.output).exists())
+
+    def test_abort_on_etag_change(self):
+        self.server.etags = {'/firmware.zip': '"v2"'}
+        ok, _ = self.download(connections=2, etag='"v1"')
+        self.assertAborted(ok)
+
+    def test_abort_on_size_change(self):
+        self.server.files = {'/firmware.zip': self.data + b'more'}
+        ok, _ = self.download(connections=2)
+        self.assertAborted(ok)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Incremental payloads: SOURCE_COPY and BSDF2 SOURCE_BSDIFF ops applied over a
+source image, and up-front rejection of ops that can't be applied
+Run with: python -m unittest discover tests
+"""
+
+import io
+import sys
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+from extract_payload import (  # noqa: E402
+    ExtractOptions, Operation, OP_SOURCE_COPY, OP_SOURCE_BSDIFF, OP_PUFFDIFF, load_payload, extract_partitions,
+)
+from synth import encode_header, encode_manifest, encode_partition  # noqa: E402
+
+BS = 4096
+
+
+def bsdf2_patch(old: bytes, new: bytes, compressor: int = 0, compress=bytes) -> bytes:
+    """A one-tuple BSDF2 patch: add (new - old) bytewise over the whole of old"""
+    ctrl = len(new).to_bytes(8, 'little') + bytes(16)
+    diff = bytes((b - a) % 256 for a, b in zip(old, new))
+    streams = [compress(ctrl), compress(diff), compress(b'')]
+    header = bytes([compressor] * 3) + b''.join(len(stream).to_bytes(8, 'little') for stream in streams[:2])
+    return b'BSDF2' + header + len(new).to_bytes(8, 'little') + b''.join(streams)
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        (self.dir / 'old').mkdir()
+        self.old = bytes(range(256)) * (4 * BS // 256)
+        (self.dir / 'old' / 'boot.img').write_bytes(self.old)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_payload(self, ops: list[tuple[Operation, bytes]], size: int) -> Path:
+        blobs = b''
+        for op, blob in ops:
+            op.data_offset, op.data_length = len(blobs), len(blob)
+            op.data_sha256 = hashlib.sha256(blob).digest() if blob else b''
+            blobs += blob
+        path = self.dir / 'payload.bin'
+        manifest = encode_manifest(BS, [encode_partition('boot', size, [op for op, _ in ops])])
+        path.write_bytes(encode_header(manifest) + blobs)
+        return path
+
+    def source_op(self, op_type: int, src: tuple, dst: tuple) -> Operation:
+        start, num = src
+        return Operation(op_type=op_type, src_extents=[src], dst_extents=[dst],
+                         src_sha256=hashlib.sha256(self.old[start * BS:(start + num) * BS]).digest())
+
+    def extract(self, path: Path) -> tuple[bool, Path]:
+        payload = load_payload(path)
+        out = self.dir / 'boot.img'
+        options = ExtractOptions(source_dir=self.dir / 'old', progress='none')
+        with redirect_stdout(io.StringIO()):
+            ok = extract_partitions(payload, payload.partitions, [out], options)
+        return ok, out
+
+    def test_copy_and_bsdiff(self):
+        old_blocks = self.old[2 * BS:4 * BS]
+        new_blocks = bytes(b ^ 0x5a for b in old_blocks)
+        path = self.write_payload([
+            (self.source_op(OP_SOURCE_COPY, (0, 2), (2, 2)), b''),
+            (self.source_op(OP_SOURCE_BSDIFF, (2, 2), (0, 2)), bsdf2_patch(old_blocks, new_blocks)),
+        ], 4 * BS)
+        ok, out = self.extract(path)
+        self.assertTrue(ok)
+        self.assertEqual(out.read_bytes(), new_blocks + self.old[:2 * BS])
+
+    def test_brotli_bsdiff(self):
+        try:
+            import brotli
+        except ImportError:
+            self.skipTest('brotli not installed')
+        old_blocks = self.old[:BS]
+        new_blocks = old_blocks[::-1]
+        path = self.write_payload([
+            (self.source_op(OP_SOURCE_BSDIFF, (0, 1), (0, 1)), bsdf2_patch(old_blocks, new_blocks, 2, brotli.compress)),
+        ], BS)
+        ok, out = self.extract(path)
+        self.assertTrue(ok)
+        self.assertEqual(out.read_bytes(), new_blocks)
+
+    def test_unsupported_op_fails_before_writing(self):
+        path = self.write_payload([
+            (self.source_op(OP_SOURCE_COPY, (0, 1), (0, 1)), b''),
+            (self.source_op(OP_PUFFDIFF, (1, 1), (1, 1)), b'PUF1' + bytes(16)),
+        ], 2 * BS)
+        (self.dir / 'boot.img').write_bytes(b'previous output')
+        ok, out = self.extract(path)
+        self.assertFalse(ok)
+        self.assertEqual(out.read_bytes(), b'previous output')
+
+    def test_failed_run_keeps_previous_output(self):
+        path = self.write_payload([
+            (self.source_op(OP_SOURCE_COPY, (0, 1), (0, 1)), b''),
+            (self.source_op(OP_SOURCE_COPY, (1, 1), (1, 1)), b''),
+        ], 2 * BS)
+        # The second op's source no longer matches src_sha256
+        (self.dir / 'old' / 'boot.img').write_bytes(self.old[:BS] + bytes(3 * BS))
+        (self.dir / 'boot.img').write_bytes(b'previous output')
+        ok, out = self.extract(path)
+        self.assertFalse(ok)
+        self.assertEqual(out.read_bytes(), b'previous output')
+        self.assertFalse((self.dir / 'boot.img.tmp').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
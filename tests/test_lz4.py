@@ -0,0 +1,85 @@
+"""
+Pure-Python LZ4 block decoder against the greedy compressor in bench/synth.py
+Run with: python -m unittest discover tests
+"""
+
+import random
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+from extract_payload import OP_LZ4, decompress, lz4_block_decompress  # noqa: E402
+from synth import lz4_block_compress  # noqa: E402
+
+
+class LZ4BlockTest(unittest.TestCase):
+
+    def roundtrip(self, data: bytes):
+        block = lz4_block_compress(data)
+        self.assertEqual(lz4_block_decompress(block, len(data)), data)
+        return block
+
+    def test_empty(self):
+        self.assertEqual(lz4_block_decompress(b'\x00', 0), b'')
+
+    def test_literal_only(self):
+        # Too short for a match: a single literals-only sequence
+        block = self.roundtrip(b'abcdefghijk')
+        self.assertEqual(block[0], 11 << 4)
+
+    def test_overlapping_match(self):
+        # offset 1 and offset 3 matches longer than their offset
+        self.roundtrip(b'x' * 100 + b'tail-literals')
+        self.roundtrip(b'abc' * 50 + b'tail-literals')
+
+    def test_length_continuations(self):
+        rng = random.Random(1)
+        noise = bytes(rng.getrandbits(8) for _ in range(600))
+        for n in (15, 16, 269, 270, 271, 525):
+            # literal runs and match lengths right at the 15/255 boundaries
+            with self.subTest(n=n):
+                self.roundtrip(noise[:n] + noise[:n] + b'0123456789ab')
+                self.roundtrip(b'm' * (n + 5) + noise[:20])
+
+    def test_mixed(self):
+        rng = random.Random(2)
+        data = bytearray()
+        while len(data) < 200000:
+            if rng.random() < 0.5 and data:
+                start = rng.randrange(len(data))
+                data += data[start:start + rng.randrange(1, 2000)]
+            else:
+                data += bytes(rng.getrandbits(8) for _ in range(rng.randrange(1, 300)))
+        self.roundtrip(bytes(data))
+
+    def test_truncated(self):
+        data = b'abc' * 100 + bytes(range(64))
+        block = lz4_block_compress(data)
+        for cut in (1, 5, len(block) // 2, len(block) - 1):
+            with self.subTest(cut=cut), self.assertRaises(ValueError):
+                lz4_block_decompress(block[:cut], len(data))
+
+    def test_bad_offset(self):
+        # one literal, then a match reaching 2 bytes back
+        with self.assertRaises(ValueError):
+            lz4_block_decompress(b'\x10a\x02\x00\x00', 16)
+
+    def test_larger_than_output(self):
+        data = b'y' * 1000 + b'tail-literals'
+        with self.assertRaises(ValueError):
+            lz4_block_decompress(lz4_block_compress(data), len(data) - 1)
+
+    def test_decompress_needs_output_size(self):
+        data = b'z' * 5000 + b'tail-literals'
+        block = lz4_block_compress(data)
+        self.assertEqual(decompress(block, OP_LZ4, output_size=len(data)), data)
+        with self.assertRaises(ValueError):
+            decompress(block, OP_LZ4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Manifest handling without op data: OperationTable, the on-disk index cache
+and the diff subcommand
+Run with: python -m unittest discover tests
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from contextlib import redirect_stdout
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+import extract_payload  # noqa: E402
+from extract_payload import (  # noqa: E402
+    Operation, OperationTable, OP_REPLACE, OP_REPLACE_XZ, OP_SOURCE_COPY, OP_ZERO, cmd_diff, diff_payloads,
+    load_payload,
+)
+from synth import encode_header, encode_manifest, encode_partition, make_payload  # noqa: E402
+
+BS = 4096
+
+
+def sample_operations() -> list[Operation]:
+    return [
+        Operation(op_type=OP_REPLACE_XZ, data_offset=0, data_length=100, dst_extents=[(0, 4)],
+                  data_sha256=hashlib.sha256(b'a').digest()),
+        Operation(op_type=OP_ZERO, dst_extents=[(4, 2), (10, 1)]),
+        Operation(op_type=OP_SOURCE_COPY, dst_extents=[(6, 3)], src_extents=[(0, 1), (7, 2)],
+                  src_sha256=hashlib.sha256(b'b').digest()),
+        Operation(op_type=OP_REPLACE, data_offset=100, data_length=2 ** 40, dst_extents=[(2 ** 33, 1)],
+                  data_sha256=hashlib.sha256(b'c').digest()),
+    ]
+
+
+def write_payload(path: Path, partitions: dict[str, list[bytes]]):
+    """Write a full payload with one REPLACE op per blob, each BS bytes long"""
+    blobs = b''
+    encoded = []
+    for name, ops in partitions.items():
+        operations = []
+        for i, blob in enumerate(ops):
+            operations.append(Operation(op_type=OP_REPLACE, data_offset=len(blobs), data_length=len(blob),
+                                        dst_extents=[(i, 1)], data_sha256=hashlib.sha256(blob).digest()))
+            blobs += blob
+        encoded.append(encode_partition(name, len(ops) * BS, operations, hashlib.sha256(b''.join(ops)).digest()))
+    path.write_bytes(encode_header(encode_manifest(BS, encoded)) + blobs)
+
+
+class OperationTableTest(unittest.TestCase):
+
+    def test_matches_operations(self):
+        ops = sample_operations()
+        table = OperationTable(ops)
+        self.assertEqual(len(table), len(ops))
+        self.assertEqual(list(table), ops)
+        self.assertEqual(table[2], ops[2])
+
+    def test_dict_roundtrip(self):
+        ops = sample_operations()
+        data = json.loads(json.dumps(OperationTable(ops).to_dict()))
+        self.assertEqual(list(OperationTable.from_dict(data)), ops)
+
+
+class IndexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.payload = self.dir / 'payload.bin'
+        make_payload(self.payload, partitions=3, ops=5, op_size=16 * 1024)
+        self.cache = self.dir / 'cache'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSamePayload(self, a, b):
+        self.assertEqual(a.block_size, b.block_size)
+        self.assertEqual(a.data_offset, b.data_offset)
+        self.assertEqual([(p.name, p.size, p.hash) for p in a.partitions],
+                         [(p.name, p.size, p.hash) for p in b.partitions])
+        for pa, pb in zip(a.partitions, b.partitions):
+            self.assertEqual(list(pa.operations), list(pb.operations))
+
+    def test_roundtrip(self):
+        parsed = load_payload(self.payload)
+        load_payload(self.payload, cache_dir=self.cache)
+        self.assertEqual(len(list(self.cache.glob('*.json'))), 1)
+        with mock.patch.object(extract_payload, 'scan_partition', side_effect=AssertionError('manifest parsed')):
+            cached = load_payload(self.payload, cache_dir=self.cache)
+        self.assertSamePayload(parsed, cached)
+
+    def test_stale_entry_ignored(self):
+        load_payload(self.payload, cache_dir=self.cache)
+        stat = self.payload.stat()
+        os.utime(self.payload, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        with mock.patch.object(extract_payload, 'scan_partition', wraps=extract_payload.scan_partition) as scan:
+            load_payload(self.payload, cache_dir=self.cache)
+        self.assertTrue(scan.called)
+
+    def test_hit_without_utime(self):
+        load_payload(self.payload, cache_dir=self.cache)
+        with mock.patch.object(extract_payload, 'scan_partition', side_effect=AssertionError('manifest parsed')), \
+                mock.patch.object(extract_payload.os, 'utime', side_effect=PermissionError):
+            cached = load_payload(self.payload, cache_dir=self.cache)
+        self.assertSamePayload(load_payload(self.payload), cached)
+
+
+class DiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.blocks = [bytes([i]) * BS for i in range(4)]
+        self.old = self.dir / 'old.bin'
+        write_payload(self.old, {'boot': self.blocks, 'dtbo': self.blocks[:2]})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def diff(self, partitions: dict[str, list[bytes]]) -> dict[str, dict]:
+        new = self.dir / 'new.bin'
+        write_payload(new, partitions)
+        return {r['name']: r for r in diff_payloads(load_payload(self.old), load_payload(new))}
+
+    def test_self_diff(self):
+        payload = load_payload(self.old)
+        results = diff_payloads(payload, payload)
+        self.assertEqual([r['status'] for r in results], ['unchanged', 'unchanged'])
+        self.assertEqual(sum(r['changed_ops'] + r['changed_bytes'] for r in results), 0)
+
+    def test_changed_op(self):
+        blocks = list(self.blocks)
+        blocks[2] = b'\xff' * BS
+        results = self.diff({'boot': blocks, 'dtbo': self.blocks[:2]})
+        self.assertEqual(results['boot']['status'], 'changed')
+        self.assertEqual((results['boot']['changed_ops'], results['boot']['changed_bytes']), (1, BS))
+        self.assertEqual(results['dtbo']['status'], 'unchanged')
+        self.assertEqual(results['dtbo']['changed_bytes'], 0)
+
+    def test_added_and_removed(self):
+        results = self.diff({'boot': self.blocks, 'vbmeta': self.blocks[:3]})
+        self.assertEqual(results['boot']['status'], 'unchanged')
+        self.assertEqual(results['vbmeta']['status'], 'added')
+        self.assertEqual(results['vbmeta']['changed_bytes'], 3 * BS)
+        self.assertEqual(results['dtbo']['status'], 'removed')
+        self.assertEqual((results['dtbo']['old_size'], results['dtbo']['new_size']), (2 * BS, None))
+
+    def test_json_output(self):
+        payload = load_payload(self.old)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            cmd_diff(payload, payload, as_json=True)
+        self.assertEqual(json.loads(out.getvalue())['changed'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
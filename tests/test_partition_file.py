@@ -0,0 +1,97 @@
+"""
+Payload.open_partition: reading parts of an image without extracting it
+Run with: python -m unittest discover tests
+"""
+
+import hashlib
+import sys
+import tempfile
+import tracemalloc
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+from extract_payload import Operation, OP_REPLACE, OP_SOURCE_COPY, OP_ZERO, load_payload  # noqa: E402
+from synth import encode_header, encode_manifest, encode_partition, make_payload  # noqa: E402
+
+BS = 4096
+
+
+class PartitionFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_payload(self, ops: list[tuple[Operation, bytes]], size: int) -> Path:
+        blobs = b''
+        for op, blob in ops:
+            op.data_offset, op.data_length = len(blobs), len(blob)
+            op.data_sha256 = hashlib.sha256(blob).digest() if blob else b''
+            blobs += blob
+        path = self.dir / 'payload.bin'
+        manifest = encode_manifest(BS, [encode_partition('boot', size, [op for op, _ in ops])])
+        path.write_bytes(encode_header(manifest) + blobs)
+        return path
+
+    def test_matches_extracted_image(self):
+        path = self.dir / 'payload.bin'
+        make_payload(path, partitions=1, ops=6, op_size=64 * 1024)
+        payload = load_payload(path)
+        part = payload.partitions[0]
+        with payload.open_partition(part.name) as f:
+            image = f.read()
+            self.assertEqual(hashlib.sha256(image).digest(), part.hash)
+            f.seek(-100, 2)
+            self.assertEqual(f.read(), image[-100:])
+            f.seek(BS - 10)
+            self.assertEqual(f.read(20), image[BS - 10:BS + 10])
+
+    def test_zero_op_reads_as_hole(self):
+        header = b'ANDROID!' + bytes(BS - 8)
+        path = self.write_payload([
+            (Operation(op_type=OP_REPLACE, dst_extents=[(0, 1)]), header),
+            (Operation(op_type=OP_ZERO, dst_extents=[(1, 200000)]), b''),
+        ], 0)
+        payload = load_payload(path)
+        with payload.open_partition('boot') as f:
+            # No size in the manifest: the last extent decides
+            self.assertEqual(f.seek(0, 2), 200001 * BS)
+            tracemalloc.start()
+            try:
+                f.seek(0)
+                self.assertEqual(f.read(64), header[:64])
+                f.seek(100000 * BS)
+                self.assertEqual(f.read(64), bytes(64))
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, 1024 * 1024)
+
+    def test_source_copy_reads_source_image(self):
+        old = bytes(range(256)) * (4 * BS // 256)
+        source = self.dir / 'old.img'
+        source.write_bytes(old)
+        # Two src extents feeding two differently split dst extents
+        src_extents = [(3, 1), (0, 2)]
+        op = Operation(op_type=OP_SOURCE_COPY, src_extents=src_extents, dst_extents=[(0, 2), (5, 1)],
+                       src_sha256=hashlib.sha256(old[3 * BS:] + old[:2 * BS]).digest())
+        path = self.write_payload([(op, b'')], 6 * BS)
+        payload = load_payload(path)
+        with payload.open_partition('boot', source) as f:
+            image = f.read()
+        self.assertEqual(image, old[3 * BS:] + old[:BS] + bytes(3 * BS) + old[BS:2 * BS])
+
+        source.write_bytes(bytes(4 * BS))
+        with payload.open_partition('boot', source) as f, self.assertRaises(ValueError):
+            f.read(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""
+Extraction from local zips and over HTTP against a range-capable local server
+Run with: python -m unittest discover tests
+"""
+
+import io
+import re
+import sys
+import hashlib
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from pathlib import Path
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+import extract_payload  # noqa: E402
+from extract_payload import ExtractOptions, HttpFile, load_payload, extract_partitions  # noqa: E402
+from synth import make_payload  # noqa: E402
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serve files from server.files with single-range support.
+
+    server.drops lists byte counts: each ranged GET takes the next one and
+    closes the connection after sending that many body bytes. Optional
+    attributes: server.etags (path -> ETag, honouring If-Range),
+    server.delay (seconds slept per 16 KB of body) and server.log, which
+    records (range start, dropped byte count) for each ranged GET.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def respond(self, body: bool):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = 0, len(data) - 1
+        etag = getattr(self.server, 'etags', {}).get(self.path)
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range != etag:
+            match = None  # changed since the client's copy: send all of it
+        drop = None
+        if body and match:
+            # Taken before responding: clients may act on the headers before the body is sent
+            with self.lock:
+                drop = self.server.drops.pop(0) if self.server.drops else None
+                if hasattr(self.server, 'log'):
+                    self.server.log.append((int(match.group(1)), drop))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if not body:
+            return
+
+        chunk = data[start:end + 1]
+        if drop is not None:
+            chunk = chunk[:drop]
+            self.close_connection = True
+        delay = getattr(self.server, 'delay', 0)
+        step = 16 * 1024 if delay else max(len(chunk), 1)
+        try:
+            for pos in range(0, len(chunk), step):
+                self.wfile.write(chunk[pos:pos + step])
+                time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class RemoteExtractTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        tmp = Path(cls.tmp.name)
+        cls.payload = tmp / 'payload.bin'
+        cls.digests = make_payload(cls.payload, partitions=2, ops=8, op_size=64 * 1024)
+        cls.zip = tmp / 'ota.zip'
+        with zipfile.ZipFile(cls.zip, 'w') as zf:
+            zf.writestr('META-INF/com/android/metadata', b'ota-type=AB\n')
+            zf.write(cls.payload, 'payload.bin', compress_type=zipfile.ZIP_STORED)
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        cls.server.files = {'/payload.bin': cls.payload.read_bytes(), '/ota.zip': cls.zip.read_bytes()}
+        cls.server.drops = []
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.server.drops = []
+
+    def extract(self, source):
+        """Extract every partition of source and check each image against its digest"""
+        payload = load_payload(source)
+        with tempfile.TemporaryDirectory() as out:
+            outputs = [Path(out) / f"{part.name}.img" for part in payload.partitions]
+            with redirect_stdout(io.StringIO()):
+                ok = extract_partitions(payload, payload.partitions, outputs, ExtractOptions(progress='none'))
+            self.assertTrue(ok)
+            for part, path in zip(payload.partitions, outputs):
+                self.assertEqual(hashlib.sha256(path.read_bytes()).digest(), self.digests[part.name], part.name)
+
+    def test_extract_zip(self):
+        self.extract(self.zip)
+
+    def test_extract_url(self):
+        self.extract(f"{self.url}/payload.bin")
+
+    def test_extract_zip_url(self):
+        self.extract(f"{self.url}/ota.zip")
+
+    def test_reconnect_after_dropped_connection(self):
+        data = self.server.files['/payload.bin']
+        with mock.patch.object(extract_payload, 'HTTP_RETRY_DELAY', 0):
+            f = HttpFile(f"{self.url}/payload.bin")
+            self.server.drops = [1000, 5000]
+            self.assertEqual(f.read(), data)
+            f.close()
+
+    def test_gives_up_after_retries(self):
+        with mock.patch.object(extract_payload, 'HTTP_RETRY_DELAY', 0):
+            f = HttpFile(f"{self.url}/payload.bin")
+            self.server.drops = [10] * (extract_payload.HTTP_RETRIES + 1)
+            with self.assertRaises(OSError):
+                f.read(100)
+            f.close()
+
+
+if __name__ == '__main__':
+    unittest.main()